@@ -0,0 +1,335 @@
+import math
+import random
+import itertools
+from statistics import mean
+
+import numpy as np
+
+from process import Process
+from constants import g, update_frequency, window
+from math_util import input_modulus, radians_to_degrees
+
+
+# Simulate many arms at once.  Each run is configured exactly as simulate()
+# would configure it, then the whole batch is stepped together as numpy
+# arrays.  The results are the same as calling simulate() on each run in turn:
+# every operation, the motors' torque curves included, is the one Process.update
+# does, element by element.
+
+def cos_array(x):
+    # Some builds of numpy vectorise cos with different rounding from math.cos.
+    return np.fromiter(map(math.cos, x.tolist()), dtype=float, count=len(x))
+
+
+def input_modulus_array(input, minimum, maximum):
+    modulus = maximum - minimum
+    num_max = np.trunc((input - minimum) / modulus)
+    input = input - num_max * modulus
+    num_min = np.trunc((input - maximum) / modulus)
+    return input - num_min * modulus
+
+
+class ArmBatch:
+    """The parameters and state of N arms, one array element per arm."""
+
+    parameters = ['mass', 'inertia', 'centre_of_mass', 'friction', 'ratio', 'n_motors', 'efficiency',
+        'f_output', 'p', 'i', 'd', 'izone', 'setpoint', 'error_bound']
+    state = ['position', 'velocity', 'output', 'last_err', 'err_acc']
+
+    def __init__(self, rows, motors):
+        for key in self.parameters + self.state:
+            setattr(self, key, np.array([row[key] for row in rows], dtype=float))
+        self.motors = list(motors)
+        self.motor_index = np.array([self.motors.index(row['motor']) for row in rows], dtype=int)
+
+    @classmethod
+    def row(cls, process):
+        """Snapshot of a configured, reset Process."""
+        model = process.model
+        gearbox = model.motor
+        pid = process.pid
+        return dict(
+            mass=model.mass,
+            inertia=model.inertia,
+            centre_of_mass=model.centre_of_mass,
+            friction=model.bearing.friction(model.mass) if model.bearing is not None else 0,
+            motor=gearbox.motor,
+            ratio=gearbox.ratio,
+            n_motors=gearbox.n_motors,
+            efficiency=gearbox.efficiency,
+            f_output=model.ff(process.f, pid.setpoint),
+            p=pid.p,
+            i=pid.i,
+            d=pid.d,
+            izone=pid.izone,
+            setpoint=pid.setpoint,
+            error_bound=pid.error_bound,
+            position=process.position,
+            velocity=process.velocity,
+            output=process.output,
+            last_err=pid.last_err,
+            err_acc=pid.err_acc,
+        )
+
+    def keep(self, mask):
+        for key in self.parameters + self.state + ['motor_index']:
+            setattr(self, key, getattr(self, key)[mask])
+
+    def arm(self, k):
+        """Element k on its own, as an Arm."""
+        return Arm({key: float(getattr(self, key)[k]) for key in self.parameters + self.state},
+            self.motors[self.motor_index[k]])
+
+    def motor_torque(self, velocity, output):
+        # As Gearbox.torque, through each motor's exact torque_array.  Not its
+        # TorqueTable: near the Falcon 500's cutoff that is out by more than
+        # enough to move a run's settling time.
+        if len(self.motors) == 1:
+            return self.motors[0].torque_array(velocity, output)
+        torque = np.empty_like(velocity)
+        for index, motor in enumerate(self.motors):
+            mask = self.motor_index == index
+            if mask.any():
+                torque[mask] = motor.torque_array(velocity[mask], output[mask])
+        return torque
+
+    def difference(self, value):
+        return input_modulus_array(value, -self.error_bound, self.error_bound)
+
+    def error(self, position):
+        return self.difference(self.setpoint - position)
+
+    def step(self, dt):
+        """Same arithmetic as Process.update, ModelArm.calculate and PID.calculate."""
+        motor_torque = self.motor_torque(self.velocity / self.ratio, self.output) * self.ratio * self.n_motors
+        torque = motor_torque * self.efficiency + (-g * self.mass * cos_array(self.position)) * self.centre_of_mass
+        torque = torque + -np.copysign(np.minimum(np.abs(torque), self.friction), self.velocity)
+        velocity = self.velocity + torque * self.inertia * dt
+        position = self.position + dt * (self.velocity + velocity) / 2
+        self.position = input_modulus_array(position, -math.pi, math.pi)
+        self.velocity = velocity
+
+        err = self.error(self.position)
+        d_err = self.difference(err - self.last_err) / dt
+        self.last_err = err
+        integrating = (np.abs(err) < self.izone) & (self.i > 0)
+        self.err_acc = np.where(integrating, self.err_acc + err * dt, 0.0)
+        output = self.p * err + self.i * self.err_acc + self.d * d_err
+        output = output + self.f_output
+        self.output = np.minimum(np.maximum(output, -1), 1)
+        return err
+
+
+class Arm:
+    """
+    One element of an ArmBatch, stepped in Python floats.  Slower per arm,
+    but without numpy's cost per call, so quicker for the last few runs.
+    """
+
+    def __init__(self, values, motor):
+        self.__dict__.update(values)
+        self.motor = motor
+
+    def difference(self, value):
+        return input_modulus(value, -self.error_bound, self.error_bound)
+
+    def step(self, dt):
+        """Same arithmetic as ArmBatch.step."""
+        motor_torque = self.motor.torque(self.velocity / self.ratio, self.output) * self.ratio * self.n_motors
+        torque = motor_torque * self.efficiency + (-g * self.mass * math.cos(self.position)) * self.centre_of_mass
+        torque = torque + -math.copysign(min(abs(torque), self.friction), self.velocity)
+        velocity = self.velocity + torque * self.inertia * dt
+        position = self.position + dt * (self.velocity + velocity) / 2
+        self.position = input_modulus(position, -math.pi, math.pi)
+        self.velocity = velocity
+
+        err = self.difference(self.setpoint - self.position)
+        d_err = self.difference(err - self.last_err) / dt
+        self.last_err = err
+        if abs(err) < self.izone and self.i > 0:
+            self.err_acc = self.err_acc + err * dt
+        else:
+            self.err_acc = 0.0
+        output = self.p * err + self.i * self.err_acc + self.d * d_err
+        output = output + self.f_output
+        self.output = min(max(output, -1), 1)
+        return err
+
+
+def _settle_point(errors, thumb, steady_state_interval):
+    """Vectorised is_settled() over errors[thumb:], for one run."""
+    reverse = errors[::-1]
+    spread = np.maximum.accumulate(reverse) - np.minimum.accumulate(reverse)
+    exceeded = np.flatnonzero(spread > steady_state_interval)
+    if len(exceeded) == 0:
+        return (True, thumb)
+    return (False, thumb + len(errors) - exceeded[0])
+
+
+def simulate_batch(process_inits, initial_positions=None):
+    """
+    Run simulate() for every process_init at once.
+
+    initial_positions is a list the same length as process_inits, or None to
+    draw each at random as simulate() does.  Returns a list of result dicts in
+    the same order, each identical to what simulate(early_stop=False) would
+    return.
+    """
+    n = len(process_inits)
+    if initial_positions is None:
+        initial_positions = [None] * n
+    assert len(initial_positions) == n
+    initial_positions = [random.uniform(-math.pi, math.pi) if x is None else x for x in initial_positions]
+
+    rows = []
+    for process_init, initial_position in zip(process_inits, initial_positions):
+        process = Process(now=0)
+        process_init(process)
+        process.reset(initial_position)
+        rows.append(ArmBatch.row(process))
+    return simulate_rows(rows, initial_positions)
+
+
+def simulate_rows(rows, initial_positions, deadline=window * 100):
+    """
+    As simulate_batch(), but from ArmBatch.row() snapshots of reset processes.
+    Runs still going at deadline (in seconds) are reported as not settled,
+    as simulate() does at its own deadline.
+    """
+    motors = []
+    for row in rows:
+        if row['motor'] not in motors:
+            motors.append(row['motor'])
+    arms = ArmBatch(rows, motors)
+    return _run(arms, initial_positions, deadline)
+
+
+# Below this many live runs, numpy's cost per call outweighs stepping each on its own.
+alone = 16
+
+
+def _run(arms, initial_positions, deadline=window * 100):
+    n = len(initial_positions)
+    results = [None] * n
+    runs = np.arange(n)
+    initial_error = arms.error(np.array(initial_positions, dtype=float))
+    overshoot = np.zeros(n)
+    thumb = np.zeros(n, dtype=int)
+    scan_window = np.full(n, window * update_frequency * 2)
+    steady_state_interval = np.abs(initial_error) * 0.02 * 2 # 2% either way
+    flip = initial_error > 0
+
+    # Error history, one column per live run.  Row 0 is step `base`; rows
+    # before every live run's thumb are discarded as the buffer fills.
+    history = np.empty((max(1024, int(scan_window[0]) * 2), n))
+    history[0] = initial_error
+    base = 0
+
+    def report(run, time, settled, initial_error, overshoot=None, thumb=None, errors=None):
+        # errors are those from thumb up to, but not including, the last step.
+        result = dict(settled=bool(settled))
+        if settled:
+            result.update(
+                steady_state_error=abs(mean(errors) / initial_error),
+                overshoot=abs(overshoot / initial_error),
+                settling_time=thumb * dt,
+            )
+        result.update(
+            initial_position=initial_positions[run],
+            initial_position_deg=radians_to_degrees(initial_positions[run]),
+            final_time=time,
+            detector=None,
+            steps_saved=0,
+        )
+        results[run] = result
+
+    def finish(done, time, settled):
+        for k in np.flatnonzero(done):
+            errors = history[thumb[k] - base:i - base, k].tolist() if settled else None
+            report(runs[k], time, settled, float(initial_error[k]), float(overshoot[k]), int(thumb[k]), errors)
+
+    def finish_alone(k, i, time):
+        # Carry on from step i exactly as below, for run k alone.
+        arm = arms.arm(k)
+        limit = abs(float(initial_error[k]))
+        interval = float(steady_state_interval[k])
+        sign = -1.0 if flip[k] else 1.0
+        peak, th, scan = float(overshoot[k]), int(thumb[k]), int(scan_window[k])
+        errors = history[th - base:i - base + 1, k].tolist() # from step th
+        last_time = time
+        # The same times as the batch's own count would have gone on to.
+        for i, time in enumerate(itertools.count(start=time + dt, step=dt), start=i + 1):
+            error = arm.step(time - last_time)
+            last_time = time
+            if abs(error) > limit or time > deadline:
+                return report(runs[k], time, False, float(initial_error[k]))
+            errors.append(error)
+            if sign * error > peak:
+                peak = sign * error
+                scan = max(i, scan)
+            if i - th > scan:
+                (settled, thumb_) = _settle_point(np.array(errors), th, interval)
+                if settled:
+                    return report(runs[k], time, True, float(initial_error[k]), peak, th, errors[:-1])
+                del errors[:thumb_ - th]
+                th = thumb_
+
+    def keep(mask):
+        nonlocal runs, initial_error, overshoot, thumb, scan_window, steady_state_interval, flip, history
+        arms.keep(mask)
+        runs = runs[mask]
+        initial_error = initial_error[mask]
+        overshoot = overshoot[mask]
+        thumb = thumb[mask]
+        scan_window = scan_window[mask]
+        steady_state_interval = steady_state_interval[mask]
+        flip = flip[mask]
+        history = history[:, mask]
+
+    dt = 1.0 / update_frequency
+    times = itertools.count(start=dt, step=dt)
+    last_time = 0
+    for i, time in enumerate(times, start=1):
+        error = arms.step(time - last_time)
+        last_time = time
+
+        failed = (np.abs(error) > np.abs(initial_error)) | (initial_error == 0)
+        if time > deadline:
+            failed[:] = True
+        if failed.any():
+            finish(failed, time, settled=False)
+            keep(~failed)
+            error = error[~failed]
+        if len(runs) == 0:
+            break
+
+        if i - base >= len(history):
+            low = int(thumb.min())
+            if low > base:
+                history[:i - low] = history[low - base:i - base]
+                base = low
+            if i - base >= len(history):
+                history = np.concatenate([history, np.empty_like(history)])
+        history[i - base] = error
+
+        error = np.where(flip, -error, error)
+        peak = error > overshoot
+        overshoot = np.where(peak, error, overshoot)
+        scan_window = np.where(peak, np.maximum(i, scan_window), scan_window)
+
+        checking = np.flatnonzero(i - thumb > scan_window)
+        if len(checking):
+            settled = np.zeros(len(runs), dtype=bool)
+            for k in checking:
+                (settled[k], thumb[k]) = _settle_point(history[thumb[k] - base:i - base + 1, k], thumb[k], steady_state_interval[k])
+            if settled.any():
+                finish(settled, time, settled=True)
+                keep(~settled)
+                if len(runs) == 0:
+                    break
+
+        if len(runs) <= alone:
+            for k in range(len(runs)):
+                finish_alone(k, i, time)
+            break
+    return results
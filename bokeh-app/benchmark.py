@@ -0,0 +1,248 @@
+import sys
+import json
+import math
+import random
+import platform
+import tracemalloc
+from time import perf_counter
+
+from process import Process, configure
+from math_util import input_modulus
+from simulation import simulate, is_settled, Cancelled
+
+# Benchmarks of the simulation core and the dashboard.  Run with:
+#
+#   python benchmark.py                        # print the results
+#   python benchmark.py --save baseline.json   # and keep them
+#   python benchmark.py --compare baseline.json
+#
+# Timings are the best of a few repeats; anything random is seeded.
+
+scenario = dict(motor="VEX BAG", ratio=150, n_motors=1, mass=5, length=1, cof=0.05, efficiency=0.85,
+    setpoint=0, f=0.3, p=0.5, i=0.1, d=0.1, izone=20)
+
+
+def make_process():
+    process = Process(now=0)
+    configure(process, scenario)
+    process.reset(-math.pi/2, now=0)
+    return process
+
+
+def steps_per_second(run, n):
+    start = perf_counter()
+    run(n)
+    return n / (perf_counter() - start)
+
+
+def bench_update(n=20000):
+    process = make_process()
+    dt = 1.0 / 50
+    def run(n):
+        for k in range(n):
+            process.update(now=(k + 1) * dt)
+    return steps_per_second(run, n)
+
+
+def bench_step(n=20000):
+    process = make_process()
+    dt = 1.0 / 50
+    process.advance(dt) # compile first, if numba is present
+    def run(n):
+        for k in range(n):
+            process.step(now=(k + 1) * dt)
+    return steps_per_second(run, n)
+
+
+def bench_advance(n=20000):
+    process = make_process()
+    process.advance(1.0 / 50)
+    return steps_per_second(lambda n: process.advance(1.0 / 50, n), n)
+
+
+# The README's scenario, and variations on it that hunt about the setpoint
+# in a limit cycle, bearing friction against the integrator, until the
+# deadline (or until predict spots it), and that diverge.
+simulations = dict(
+    settled=dict(scenario),
+    oscillating=dict(scenario, f=0, p=0.05, i=0.05, d=0, izone=90),
+    diverging=dict(scenario, f=1, p=0, i=0, d=0),
+)
+
+
+def best_of(run, repeats=3):
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        run()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def bench_simulate():
+    """
+    Wall time of simulate() from horizontal, for each of simulations, as
+    is, with predict, and without the early stop.
+    """
+    results = {}
+    options = { '': dict(), '_predict': dict(predict=True), '_full': dict(early_stop=False) }
+    for name, config in simulations.items():
+        for suffix, kwargs in options.items():
+            run = lambda: simulate(lambda process: configure(process, config), -math.pi/2, **kwargs)
+            results[name + suffix] = best_of(run, repeats=1 if suffix == '_full' else 3)
+    return results
+
+
+def bench_is_settled(lengths=(1000, 10000, 100000)):
+    """Time for one is_settled() over an error list of each length, the way simulate() used to call it."""
+    rng = random.Random(0)
+    results = {}
+    for n in lengths:
+        errors = [math.exp(-k / (n / 5)) * math.cos(k / 50) + rng.gauss(0, 1e-4) for k in range(n)]
+        results[n] = best_of(lambda: is_settled(errors, 0, 0.02 * 2))
+    return results
+
+
+def bench_memory(minutes=(1, 4)):
+    """
+    Memory simulate() holds, measured at two points of one run of the
+    oscillating scenario (which never settles): (growth per simulated minute
+    between them, peak per simulated minute).  Anything kept per step shows
+    up as growth, however short the run.
+    """
+    held = {}
+    def progress(time, error):
+        for minute in minutes:
+            if time >= minute * 60 and minute not in held:
+                held[minute] = tracemalloc.get_traced_memory()[0]
+        if len(held) == len(minutes):
+            raise Cancelled()
+    tracemalloc.start()
+    try:
+        simulate(lambda process: configure(process, simulations['oscillating']), -math.pi/2, progress=progress,
+            early_stop=False)
+    except Cancelled:
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    first, last = minutes
+    return ((held[last] - held[first]) / (last - first), peak / last)
+
+
+def bench_dashboard(sessions=(1, 10)):
+    """Scheduler tick and dashboard frame costs with each number of sessions, from the load test."""
+    from loadtest import measure
+    return { n: measure(n) for n in sessions }
+
+
+def bench_cold_start():
+    """Wall time of the headless CLI analyzing one quick configuration, from a fresh interpreter."""
+    import os
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    run = lambda: subprocess.run([sys.executable, '-m', 'pid_demo', 'analyze', '--workers', '1'],
+        cwd=here, check=True, stdout=subprocess.DEVNULL)
+    return best_of(run)
+
+
+def bench_optimizer():
+    """The cost the optimizer reaches for the README's arm, and a grid search's with the same number of simulations."""
+    from optimize import optimize, grid_search
+    config = { key: value for key, value in scenario.items() if key not in ['f', 'p', 'i', 'd', 'izone'] }
+    best = optimize(config)
+    return dict(optimizer=best['cost'], grid=grid_search(config, best['evaluations'])['cost'], evaluations=best['evaluations'])
+
+
+def swing(integrator, dt, seconds=5.0):
+    """Let the arm fall from horizontal with a little motor drive, and no feedback."""
+    process = Process(now=0)
+    configure(process, dict(scenario, f=0.15, p=0, i=0, d=0, setpoint=0))
+    process.set_integrator(integrator)
+    process.reset(0, now=0)
+    process.model.evaluations = 0
+    n = int(round(seconds / dt))
+    start = perf_counter()
+    for k in range(n):
+        process.update(now=(k + 1) * dt)
+    return dict(position=process.position, velocity=process.velocity,
+        evaluations=process.model.evaluations / seconds, elapsed=perf_counter() - start)
+
+
+def bench_integrators(seconds=5.0):
+    """Accuracy and cost of each integrator at the usual step, against a fine-step reference."""
+    reference = swing('rk4', 1.0 / 50 / 100, seconds)
+    results = {}
+    for integrator in ['euler', 'semi_implicit_euler', 'rk4', 'rk45']:
+        result = swing(integrator, 1.0 / 50, seconds)
+        result['position_error'] = abs(input_modulus(result['position'] - reference['position'], -math.pi, math.pi))
+        result['velocity_error'] = abs(result['velocity'] - reference['velocity'])
+        results[integrator] = result
+    return results
+
+
+def run_all():
+    """Every benchmark, as { name: dict(value, unit, better) }."""
+    random.seed(0)
+    results = {}
+    def record(name, value, unit, better='lower'):
+        results[name] = dict(value=value, unit=unit, better=better)
+    for name, bench in [('update', bench_update), ('step', bench_step), ('advance', bench_advance)]:
+        record(f"Process.{name}", max(bench() for _ in range(3)), "steps/s", 'higher')
+    for name, seconds in bench_simulate().items():
+        record(f"simulate.{name}", seconds, "s")
+    for n, seconds in bench_is_settled().items():
+        record(f"is_settled.{n}", seconds, "s")
+    (growth, peak) = bench_memory()
+    record("simulate.memory_growth_per_minute", growth, "bytes")
+    record("simulate.memory_per_minute", peak, "bytes")
+    record("cli.cold_start", bench_cold_start(), "s")
+    result = bench_optimizer()
+    record("optimizer.cost", result['optimizer'], "cost")
+    record("optimizer.grid_cost", result['grid'], "cost")
+    for name, result in bench_integrators().items():
+        record(f"integrator.{name}.position_error", result['position_error'], "rad")
+        record(f"integrator.{name}.elapsed", result['elapsed'], "s")
+    for n, result in bench_dashboard().items():
+        record(f"dashboard.{n}.tick", result['tick_ms'], "ms")
+        record(f"dashboard.{n}.frame", result['frame_ms'], "ms")
+        record(f"dashboard.{n}.traffic", result['bytes_per_second'], "bytes/s")
+    return results
+
+
+def numba_version():
+    """numba's version, or None: without it the kernel runs as Python, and its timings mean little."""
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba.__version__
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Lines comparing results with a saved baseline, marking changes beyond tolerance."""
+    lines = []
+    for name, result in results.items():
+        if name not in baseline['results']:
+            lines.append(f"{name:44} {result['value']:14.6g} {result['unit']:8} (new)")
+            continue
+        old = baseline['results'][name]['value']
+        ratio = result['value'] / old if old else 1.0 if result['value'] == old else float('inf')
+        worse = ratio > 1 + tolerance if result['better'] == 'lower' else ratio < 1 - tolerance
+        better = ratio < 1 - tolerance if result['better'] == 'lower' else ratio > 1 + tolerance
+        mark = "WORSE" if worse else "better" if better else ""
+        lines.append(f"{name:44} {result['value']:14.6g} {result['unit']:8} {ratio:7.2f}x {mark}")
+    return lines
+
+
+if __name__ == "__main__":
+    results = run_all()
+    if '--compare' in sys.argv:
+        with open(sys.argv[sys.argv.index('--compare') + 1]) as f:
+            print("\n".join(compare(results, json.load(f))))
+    else:
+        for name, result in results.items():
+            print(f"{name:44} {result['value']:14.6g} {result['unit']}")
+    if '--save' in sys.argv:
+        with open(sys.argv[sys.argv.index('--save') + 1], 'w') as f:
+            json.dump(dict(python=platform.python_version(), machine=platform.machine(), processor=platform.processor(),
+                numba=numba_version(), results=results), f, indent=2)
@@ -0,0 +1,113 @@
+import json
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from constants import g, update_frequency, window
+
+# simulate() is deterministic once the initial position is fixed, so its
+# results can be kept, keyed on everything that goes into it.
+
+# Bump when a change to the simulation changes its results.
+version = 4
+
+
+def _normalised(value):
+    # Sliders give 150 or 150.0 for the same setting; both simulate the same.
+    if isinstance(value, dict):
+        return { k: _normalised(v) for k, v in value.items() }
+    if isinstance(value, (list, tuple)):
+        return [_normalised(v) for v in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def key(values, initial_position, **options):
+    """
+    A digest of the control values (as passed to process.configure), the
+    initial position, any other simulate() options, and the constants.
+    Numbers are compared as floats.
+    """
+    content = _normalised(dict(values=values, initial_position=initial_position, options=options,
+        constants=dict(g=g, update_frequency=update_frequency, window=window), version=version))
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Simulation results by key(): an in-memory LRU of up to capacity results,
+    in front of an optional SQLite file that server processes can share.
+    Safe to use from several threads.
+    """
+    def __init__(self, capacity=1024, path=None):
+        self.capacity = capacity
+        self.path = path
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.local = threading.local()
+        if path is not None:
+            with self.connection() as db:
+                db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT)")
+
+    def connection(self):
+        # sqlite3 connections can't be shared between threads.
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=10)
+        return db
+
+    def _remember(self, key, result):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """The result stored under key, or None."""
+        with self.lock:
+            if key in self.memory:
+                self.hits += 1
+                self.memory.move_to_end(key)
+                return dict(self.memory[key])
+        if self.path is not None:
+            row = self.connection().execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                result = json.loads(row[0])
+                with self.lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._remember(key, result)
+                return dict(result)
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        with self.lock:
+            self._remember(key, dict(result))
+        if self.path is not None:
+            with self.connection() as db:
+                db.execute("INSERT OR REPLACE INTO results VALUES (?, ?)", (key, json.dumps(result)))
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+        if self.path is not None:
+            with self.connection() as db:
+                db.execute("DELETE FROM results")
+
+    @property
+    def stats(self):
+        with self.lock:
+            return dict(hits=self.hits, disk_hits=self.disk_hits, misses=self.misses, size=len(self.memory))
+
+    def describe(self):
+        """stats, as a line of text."""
+        stats = self.stats
+        return (f"Result cache: {stats['hits']:,} hits ({stats['disk_hits']:,} from disk), "
+            f"{stats['misses']:,} misses, {stats['size']:,} in memory")
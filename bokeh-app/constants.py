@@ -1,4 +1,7 @@
 g = 10
 update_frequency = 50
+physics_frequency = 1000
+max_lag = 0.25
 window = 30
 frame_rate = 5
+idle_timeout = 300
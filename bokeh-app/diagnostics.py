@@ -0,0 +1,227 @@
+import json
+import math
+from time import perf_counter, time
+
+from constants import update_frequency, max_lag
+
+# Where the time goes, for the whole server process.
+#
+# enable() wraps the hot methods (ModelArm.calculate, PID.calculate,
+# Process._update and so on) in timers, and disable() puts the originals
+# back, so when it's off they cost nothing at all.  The Bokeh callbacks,
+# which are closures, are wrapped once with timed() and only check a flag.
+# snapshot() returns everything as a dict, ready for json; dump() writes it
+# to a file.
+
+enabled = False
+
+
+class Histogram:
+    """Counts of durations in log-spaced buckets, four a decade from 1µs."""
+    buckets_per_decade = 4
+    smallest = 1e-6
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        bucket = max(0, int(math.log10(max(seconds, self.smallest) / self.smallest) * self.buckets_per_decade))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def upper(self, bucket):
+        return self.smallest * 10 ** ((bucket + 1) / self.buckets_per_decade)
+
+    def percentile(self, q):
+        """An upper bound on the q'th percentile, to within a bucket."""
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= q / 100 * self.count:
+                return min(self.upper(bucket), self.max)
+        return 0.0
+
+    def summary(self):
+        return dict(count=self.count, total_s=self.total, mean_us=1e6 * self.total / self.count if self.count else 0,
+            p50_us=1e6 * self.percentile(50), p95_us=1e6 * self.percentile(95), p99_us=1e6 * self.percentile(99),
+            max_us=1e6 * self.max,
+            histogram={ f"<{1e6 * self.upper(bucket):.3g}us": n for bucket, n in sorted(self.counts.items()) })
+
+
+stages = {}
+counters = {}
+since = time()
+
+
+def stage(name):
+    if name not in stages:
+        stages[name] = Histogram()
+    return stages[name]
+
+
+def count(name, n=1):
+    counters[name] = counters.get(name, 0) + n
+
+
+def reset():
+    global since
+    stages.clear()
+    counters.clear()
+    since = time()
+
+
+def timed(name, callback):
+    """Wrap callback to be timed as stage name while enabled."""
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return callback(*args, **kwargs)
+        start = perf_counter()
+        try:
+            return callback(*args, **kwargs)
+        finally:
+            stage(name).add(perf_counter() - start)
+    return wrapper
+
+
+class Interval:
+    """Times between calls of a periodic callback, counting those late by more than half a period."""
+    def __init__(self, name, period):
+        self.name = name
+        self.period = period
+        self.last = None
+
+    def tick(self):
+        now = perf_counter()
+        if self.last is not None:
+            interval = now - self.last
+            stage(self.name).add(max(0, interval - self.period))
+            if interval > 1.5 * self.period:
+                count(self.name + '_late')
+        self.last = now
+
+
+scheduler_lag = Interval('scheduler_lag', 1.0 / update_frequency)
+
+
+def _wrap(cls, method, name):
+    original = cls.__dict__[method]
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            stage(name).add(perf_counter() - start)
+    wrapper.original = original
+    setattr(cls, method, wrapper)
+
+
+def _wrap_advance(cls):
+    original = cls.__dict__['advance']
+    def advance(self, dt, n=1, control=True):
+        start = perf_counter()
+        try:
+            return original(self, dt, n, control)
+        finally:
+            stage('Process.advance').add(perf_counter() - start)
+    advance.original = original
+    cls.advance = advance
+
+
+def _wrap_run(cls):
+    original = cls.__dict__['run']
+    def run(self, now=None):
+        if now is None:
+            now = time()
+        owed = self.lag / self.physics_frequency + now - self.last_time
+        if owed > max_lag:
+            count('dropped_physics_seconds', owed - max_lag)
+        steps = self.physics_steps
+        result = original(self, now)
+        count('physics_steps', self.physics_steps - steps)
+        return result
+    run.original = original
+    cls.run = run
+
+
+def _targets():
+    from model import ModelArm
+    from pid import PID
+    from process import Process
+    from session import Session, Scheduler
+    from bokeh.models import ColumnDataSource
+    return [
+        (ModelArm, 'calculate', 'ModelArm.calculate'),
+        (PID, 'calculate', 'PID.calculate'),
+        (Process, '_update', 'Process._update'),
+        (Session, 'tick', 'Session.tick'),
+        (Scheduler, 'tick', 'Scheduler.tick'),
+        (ColumnDataSource, 'stream', 'source.stream'),
+    ]
+
+
+def enable():
+    global enabled
+    if enabled:
+        return
+    from process import Process
+    from session import Scheduler
+    for cls, method, name in _targets():
+        _wrap(cls, method, name)
+    _wrap_advance(Process)
+    _wrap_run(Process)
+    tick = Scheduler.tick
+    def scheduler_tick(self):
+        scheduler_lag.tick()
+        return tick(self)
+    scheduler_tick.original = tick.original
+    Scheduler.tick = scheduler_tick
+    scheduler_lag.last = None
+    enabled = True
+
+
+def disable():
+    global enabled
+    if not enabled:
+        return
+    from process import Process
+    for cls, method, name in _targets():
+        setattr(cls, method, getattr(cls, method).original)
+    for method in ['advance', 'run']:
+        setattr(Process, method, getattr(Process, method).original)
+    enabled = False
+
+
+def snapshot():
+    elapsed = time() - since
+    result = dict(enabled=enabled, seconds=elapsed,
+        stages={ name: histogram.summary() for name, histogram in sorted(stages.items()) },
+        counters=dict(counters))
+    result['steps_per_second'] = counters.get('physics_steps', 0) / elapsed if elapsed else 0
+    # What Process._update spends outside the model and the PID: assembling the
+    # result, the column checks (asserts) and the trace, if any.
+    if 'Process._update' in stages:
+        inner = sum(stages[name].total for name in ['ModelArm.calculate', 'PID.calculate'] if name in stages)
+        result['Process._update_other_s'] = stages['Process._update'].total - inner
+    return result
+
+
+def describe():
+    """snapshot(), as lines of text."""
+    result = snapshot()
+    lines = [f"{result['steps_per_second']:,.0f} physics steps/s over {result['seconds']:.0f}s"]
+    for name, summary in result['stages'].items():
+        lines.append(f"{name}: {summary['count']:,} calls, total {summary['total_s']:.3f}s, mean {summary['mean_us']:.1f}µs, "
+            f"p50 {summary['p50_us']:.1f}µs, p95 {summary['p95_us']:.1f}µs, max {summary['max_us']:.1f}µs")
+    for name, value in sorted(result['counters'].items()):
+        lines.append(f"{name}: {value:,.3g}")
+    return lines
+
+
+def dump(path):
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=2)
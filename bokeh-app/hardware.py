@@ -0,0 +1,157 @@
+import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import cpu_count
+
+from process import Process, configure
+from motor import Motor
+from constants import g, window
+from search import evaluate, grid, linspace, gains as gain_names
+from optimize import cost, bounds
+from linear import holding_output
+import cache
+
+# Did we pick the best gear ratio?  What if we used a different motor?  For
+# the arm in config, try every motor, ratio and number of motors, e.g.
+#
+#   config = dict(mass=5, length=1, cof=0.05, efficiency=0.85, setpoint=0)
+#   for result in sweep(config):
+#       ...  # as each finishes
+#   rank(results)[0]  # the best
+#
+# Each combination gets the f that holds the arm level against gravity, then
+# a small grid of the other gains, simulated a batch at a time, from the best
+# of which (by optimize.cost) a pattern search refines the gains that varied,
+# so that the winner isn't just wherever the grid happens to end.  What it
+# finds stands for what that hardware can do.  Combinations that can't hold
+# the arm level at all aren't simulated.
+
+default_ratios = [10, 20, 50, 100, 200, 500, 1000]
+default_n_motors = [1, 2, 3]
+default_gains = dict(p=linspace(0.1, 1, 5), i=[0, 0.1], d=[0, 0.05, 0.1, 0.2, 0.4], izone=[20])
+default_refinements = 3
+# As for the stability map, runs that take longer are as good as unsettled.
+deadline = window * 10
+
+
+def combinations(motors=None, ratios=default_ratios, n_motors=default_n_motors):
+    """Every combination of hardware, as dicts of control values."""
+    return [dict(motor=motor, ratio=ratio, n_motors=n) for motor in motors or list(Motor.motors)
+        for ratio in ratios for n in n_motors]
+
+
+def feedforward(values):
+    """The f that holds the arm level against gravity, or None if the motors can't."""
+    process = Process(now=0)
+    configure(process, values)
+    model = process.model
+    output, holds = holding_output(model.motor, g * model.mass * model.centre_of_mass)
+    return output if holds else None
+
+
+def refine(best, gains, refinements, simulate):
+    """
+    Pattern search from best: each round tries a step up and down in each
+    gain that had more than one value, starting from half the grid's spacing
+    there, moves to the best if it's better and otherwise halves the steps.
+    """
+    steps = { gain: min(abs(value - best[gain]) for value in grid_values if value != best[gain]) / 2
+        for gain, grid_values in gains.items() if len(grid_values) > 1 }
+    for _ in range(refinements):
+        candidates = []
+        for gain, step in steps.items():
+            for value in [best[gain] - step, best[gain] + step]:
+                if bounds[gain][0] <= value <= bounds[gain][1]:
+                    candidates.append({ **{ gain: best[gain] for gain in gains }, 'f': best['f'], gain: value })
+        better = [result for result in simulate(candidates) if cost(result) < cost(best)]
+        if better:
+            best = min(better, key=cost)
+        else:
+            steps = { gain: step / 2 for gain, step in steps.items() }
+    return best
+
+
+def evaluate_hardware(config, hardware, gains=default_gains, initial_position=-math.pi/2,
+        refinements=default_refinements, batch_size=25, progress=None):
+    """
+    The best result of the gains on config with hardware, and the gains that
+    gave it.  If given, progress() is called before each batch, and may
+    raise to stop.
+    """
+    values = {**config, **hardware}
+    f = feedforward(values)
+    if f is None:
+        return dict(hardware, f=None, settled=False, cost=None)
+
+    best = None
+
+    def simulate(candidates):
+        nonlocal best
+        results = []
+        for k in range(0, len(candidates), batch_size):
+            if progress is not None:
+                progress()
+            cutoff = deadline
+            if best is not None and best['settled']:
+                # A run is only seen to settle once it's stayed settled as long
+                # again (and at least 2 windows; see batch), so runs still going
+                # after this can't beat the best so far.
+                cutoff = min(deadline, 2 * (cost(best) + window) + 1)
+            batch = evaluate(values, candidates[k:k + batch_size], initial_position, cutoff)
+            best = min(batch + ([best] if best is not None else []), key=cost)
+            results += batch
+        return results
+
+    simulate([dict(candidate, f=f) for candidate in grid(**gains)])
+    best = refine(best, gains, refinements, simulate)
+    return dict(hardware, **best, cost=cost(best))
+
+
+def sweep(config, hardware=None, gains=default_gains, initial_position=-math.pi/2, workers=None, results=None,
+        progress=None):
+    """
+    Evaluate each combination of hardware (default every one) on the arm in
+    config, yielding the results as they finish, across a pool of worker
+    processes.  If given, results is a cache.ResultCache to keep them in.
+    With one worker, progress is passed on to evaluate_hardware(), so it can
+    stop a combination part way through.
+    """
+    config = { key: value for key, value in config.items() if key not in gain_names + ['motor', 'ratio', 'n_motors'] }
+    hardware = hardware or combinations()
+    key = lambda combination: cache.key({**config, **combination}, initial_position, hardware_sweep=gains,
+        refinements=default_refinements, deadline=deadline)
+    todo = []
+    for combination in hardware:
+        result = results.get(key(combination)) if results is not None else None
+        if result is not None:
+            yield result
+        else:
+            todo.append(combination)
+
+    def done(combination, result):
+        if results is not None:
+            results.put(key(combination), result)
+        return result
+
+    workers = min(workers or cpu_count() or 1, len(todo) or 1)
+    if workers == 1:
+        for combination in todo:
+            yield done(combination, evaluate_hardware(config, combination, gains, initial_position,
+                progress=progress))
+        return
+    executor = ProcessPoolExecutor(max_workers=workers)
+    futures = {}
+    try:
+        futures = { executor.submit(evaluate_hardware, config, combination, gains, initial_position): combination
+            for combination in todo }
+        for future in as_completed(futures):
+            yield done(futures[future], future.result())
+    finally:
+        # Including when the caller stops early.  (shutdown's cancel_futures is 3.9+.)
+        for future in futures:
+            future.cancel()
+        executor.shutdown()
+
+
+def rank(results):
+    """Best first; those that can't hold the arm last."""
+    return sorted(results, key=lambda result: math.inf if result['cost'] is None else result['cost'])
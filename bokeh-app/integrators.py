@@ -0,0 +1,91 @@
+# Ways of advancing the arm's (position, velocity) by dt, holding the motor
+# output constant.  Each takes acceleration(position, velocity), the state,
+# the acceleration already calculated at that state, and dt, and returns the
+# new (position, velocity).  Positions are not wrapped here.
+
+def euler(acceleration, position, velocity, a, dt):
+    # Explicit Euler for velocity, trapezoidal for position.  The original.
+    new_velocity = velocity + a * dt
+    return (position + dt * (velocity + new_velocity) / 2, new_velocity)
+
+
+def semi_implicit_euler(acceleration, position, velocity, a, dt):
+    new_velocity = velocity + a * dt
+    return (position + new_velocity * dt, new_velocity)
+
+
+def rk4(acceleration, position, velocity, a, dt):
+    k1 = (velocity, a)
+    k2 = (velocity + k1[1] * dt / 2, acceleration(position + k1[0] * dt / 2, velocity + k1[1] * dt / 2))
+    k3 = (velocity + k2[1] * dt / 2, acceleration(position + k2[0] * dt / 2, velocity + k2[1] * dt / 2))
+    k4 = (velocity + k3[1] * dt, acceleration(position + k3[0] * dt, velocity + k3[1] * dt))
+    return (position + dt / 6 * (k1[0] + 2 * k2[0] + 2 * k3[0] + k4[0]),
+        velocity + dt / 6 * (k1[1] + 2 * k2[1] + 2 * k3[1] + k4[1]))
+
+
+# Dormand-Prince 5(4) tableau
+_c = [0, 1/5, 3/10, 4/5, 8/9, 1, 1]
+_a = [
+    [],
+    [1/5],
+    [3/40, 9/40],
+    [44/45, -56/15, 32/9],
+    [19372/6561, -25360/2187, 64448/6561, -212/729],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+    [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84],
+]
+_b5 = [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0]
+_b4 = [5179/57600, 0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40]
+
+
+class RK45:
+    """
+    Adaptive Dormand-Prince 5(4), taking as many substeps within dt as the
+    error control needs.  The step size carries over between calls, so while
+    the arm is still it takes all of dt at once, and during transients it
+    shrinks.
+    """
+    def __init__(self, rtol=1e-6, atol=1e-9, min_step=1e-6):
+        self.rtol = rtol
+        self.atol = atol
+        self.min_step = min_step
+        self.step = None
+
+    def __call__(self, acceleration, position, velocity, a, dt):
+        t = 0
+        h = dt if self.step is None else min(self.step, dt)
+        while t < dt:
+            proposed = h
+            h = min(h, dt - t)
+            k = [(velocity, a)]
+            for stage in range(1, 7):
+                p = position + h * sum(coefficient * kp for coefficient, (kp, kv) in zip(_a[stage], k))
+                v = velocity + h * sum(coefficient * kv for coefficient, (kp, kv) in zip(_a[stage], k))
+                k.append((v, acceleration(p, v)))
+            # The 7th stage is at the new state, which is First Same As Last.
+            error = max(
+                abs(h * sum((b5 - b4) * kp for b5, b4, (kp, kv) in zip(_b5, _b4, k))) / (self.atol + self.rtol * abs(p)),
+                abs(h * sum((b5 - b4) * kv for b5, b4, (kp, kv) in zip(_b5, _b4, k))) / (self.atol + self.rtol * abs(v)))
+            if error <= 1 or h <= self.min_step:
+                t += h
+                position, velocity, a = p, v, k[6][1]
+            clipped = h < proposed
+            h = max(self.min_step, h * min(5, max(0.2, 0.9 * (error or 1e-10) ** -0.2)))
+        # Not the last step, if it was cut short to end at dt, but what the
+        # error control had proposed.
+        self.step = max(h, proposed) if clipped else h
+        return (position, velocity)
+
+
+integrators = dict(
+    euler=euler,
+    semi_implicit_euler=semi_implicit_euler,
+    rk4=rk4,
+    rk45=RK45,
+)
+
+
+def get_integrator(name):
+    integrator = integrators[name]
+    # RK45 keeps state, so each model gets its own.
+    return integrator() if isinstance(integrator, type) else integrator
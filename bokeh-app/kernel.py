@@ -0,0 +1,74 @@
+import math
+
+# One fused function advancing the arm, motor and PID together on plain
+# floats, for when nobody needs the telemetry.  This is the arithmetic of
+# Process.update, ModelArm.calculate, Gearbox.torque, Motor.torque and
+# PID.calculate, with the motor curves as cubic polynomials in voltage (see
+# Motor.curves).  It agrees with them up to rounding.
+#
+# If numba is installed the loop is compiled, otherwise it runs as Python.
+# numba is only imported on the first call, as it's slow to import and
+# simulate() doesn't use the kernel.
+
+
+def _steps(n, dt, control, position, velocity, output, last_err, err_acc,
+        inertia, gravity, friction,
+        voltage, stall_torque, free_speed, ratio, n_motors, efficiency,
+        p, i, d, izone, setpoint, error_bound, f_output):
+    """
+    Advance n steps of dt, returning (position, velocity, output, last_err,
+    err_acc).  Without control, the PID isn't run and output is held.
+    """
+    s0, s1, s2, s3 = stall_torque
+    w0, w1, w2, w3 = free_speed
+    modulus = 2 * error_bound
+    for _ in range(n):
+        # Motor, through the gearbox
+        motor_voltage = output * voltage
+        v = abs(motor_voltage)
+        stall = max(0.0, s0 + v * (s1 + v * (s2 + v * s3)))
+        free = max(0.0, w0 + v * (w1 + v * (w2 + v * w3)))
+        if free > 0:
+            torque = stall * (1 - velocity / ratio * math.copysign(1.0, motor_voltage) / free)
+        else:
+            torque = stall
+        torque = math.copysign(torque, motor_voltage) * ratio * n_motors * efficiency
+
+        # Arm
+        torque += -gravity * math.cos(position)
+        torque += -math.copysign(min(abs(torque), friction), velocity)
+        new_velocity = velocity + torque * inertia * dt
+        position += dt * (velocity + new_velocity) / 2
+        velocity = new_velocity
+        position -= int((position + math.pi) / (2 * math.pi)) * (2 * math.pi)
+        position -= int((position - math.pi) / (2 * math.pi)) * (2 * math.pi)
+        if not control:
+            continue
+
+        # PID
+        err = setpoint - position
+        err -= int((err + error_bound) / modulus) * modulus
+        err -= int((err - error_bound) / modulus) * modulus
+        d_err = err - last_err
+        d_err -= int((d_err + error_bound) / modulus) * modulus
+        d_err -= int((d_err - error_bound) / modulus) * modulus
+        d_err /= dt
+        last_err = err
+        if abs(err) < izone and i > 0:
+            err_acc += err * dt
+        else:
+            err_acc = 0.0
+        output = min(1.0, max(-1.0, p * err + i * err_acc + d * d_err + f_output))
+    return (position, velocity, output, last_err, err_acc)
+
+
+
+def steps(*args):
+    global steps
+    try:
+        from numba import njit
+    except ImportError:
+        steps = _steps
+    else:
+        steps = njit(cache=True)(_steps)
+    return steps(*args)
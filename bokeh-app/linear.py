@@ -0,0 +1,238 @@
+import math
+
+import numpy as np
+
+from constants import g, update_frequency, window
+from math_util import radians_to_degrees
+
+# The arm and PID linearized about the setpoint, for answers in a millisecond
+# rather than a simulation, e.g.
+#
+#   process = Process(now=0)
+#   configure(process, values)
+#   result = stability(process)
+#   result['stable'], result['overshoot'], result['phase_margin']
+#
+# Each step of simulate() is the arm moving for dt under last step's output,
+# then the PID reading the new position; linearized, that's
+#
+#   x' = A x    with x = (position, velocity, output, last_err, err_acc)
+#
+# about the arm at rest at the setpoint, holding it there with whatever output
+# balances gravity.  Gravity linearizes through cos(position), and the motor
+# through the slopes of its torque in output and in velocity (the back-EMF),
+# taken from the gearbox's own torque.  Bearing friction doesn't linearize:
+# it's reported as the band of errors it can hold the arm in.  Nor do the
+# output clamp or izone, except that the integrator only runs if izone > 0.
+#
+# The closed loop is stable if every eigenvalue of A is inside the unit circle.
+# The overshoot and settling time are those of the linear arm let go from off
+# the setpoint, which takes one matrix power per pole.  Margins and bandwidth come from the
+# loop's frequency response, up to the Nyquist frequency.
+#
+# It's a pre-check, and the arm isn't linear, so simulate() can disagree: on
+# the README's arm, p=0.3, i=1, d=0.02 has poles at |z|=1.013, but the output
+# clamp and friction limit the growth, and it settles in 8.68s.  Whereas
+# f=0, p=0.05, i=0.05, d=0, izone=90, with poles at |z|=1.009, does hunt about
+# the setpoint until the deadline.
+
+
+def holding_output(gearbox, torque):
+    """The output at which gearbox gives torque at rest, clamped to ±1, and whether it's within them."""
+    torque_at = lambda output: gearbox.torque(0, output)['gearbox_torque']
+    holds = torque_at(1) >= torque >= torque_at(-1)
+    low, high = -1.0, 1.0
+    for _ in range(60):
+        middle = (low + high) / 2
+        if torque_at(middle) < torque:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2, holds
+
+
+class Linearization:
+    """The slopes of the arm's acceleration about the setpoint, and the PID gains."""
+    def __init__(self, process, dt=1.0 / update_frequency):
+        model = process.model
+        gearbox = model.motor
+        pid = process.pid
+        self.dt = dt
+        self.setpoint = pid.setpoint
+        self.p, self.i, self.d = pid.p, pid.i, pid.d
+        self.integrating = pid.i > 0 and pid.izone > 0
+        self.f_output = model.ff(process.f, pid.setpoint)
+        self.inertia = model.inertia
+        self.gravity = g * model.mass * model.centre_of_mass * math.cos(pid.setpoint)
+        self.friction = model.bearing.friction(model.mass) if model.bearing is not None else 0
+
+        torque = lambda velocity, output: gearbox.torque(velocity, output)['gearbox_torque']
+        # The output that holds the arm still against gravity, if any.
+        self.output, self.holds = holding_output(gearbox, self.gravity)
+        # Torque is linear in output, or for the Falcon 500 a gentle cubic.
+        h = 1e-3
+        self.d_output = (torque(0, self.output + h) - torque(0, self.output - h)) / (2 * h)
+        # It's exactly linear in velocity, except at zero output, where it's zero.
+        output = self.output if self.output != 0 else 1e-9
+        self.d_velocity = torque(1, output) - torque(0, output)
+        self.d_position = g * model.mass * model.centre_of_mass * math.sin(pid.setpoint)
+
+    def matrix(self):
+        """A, as above."""
+        dt = self.dt
+        # Acceleration as a row over (position, velocity, output).
+        a = self.inertia * np.array([self.d_position, self.d_velocity, self.d_output])
+        arm = np.array([[1, dt, 0], [0, 1, 0], [0, 0, 0]]) + np.outer([dt * dt / 2, dt, 0], a)
+        A = np.zeros((5, 5))
+        A[:2, :3] = arm[:2]
+        error = -A[0] # err = setpoint - position
+        A[3] = error
+        if self.integrating:
+            A[4] = error * dt
+            A[4, 4] += 1
+        A[2] = self.p * error + self.i * A[4] + self.d * (error - np.eye(5)[3]) / dt
+        return A
+
+    def loop(self, frequencies):
+        """The loop gain at each frequency (Hz), broken at the output."""
+        dt = self.dt
+        z = np.exp(2j * math.pi * np.asarray(frequencies) * dt)
+        a = self.inertia * np.array([self.d_position, self.d_velocity, self.d_output])
+        arm = np.array([[1, dt], [0, 1]]) + np.outer([dt * dt / 2, dt], a[:2])
+        b = np.array([dt * dt / 2, dt]) * a[2]
+        # Position per unit output, through (zI - arm)^-1 b.
+        det = (z - arm[0, 0]) * (z - arm[1, 1]) - arm[0, 1] * arm[1, 0]
+        plant = ((z - arm[1, 1]) * b[0] + arm[0, 1] * b[1]) / det
+        controller = self.p + (self.i * dt * z / (z - 1) if self.integrating else 0) + self.d * (1 - 1 / z) / dt
+        return plant * controller
+
+
+def _crossing(frequencies, values, level):
+    """The first frequency at which values falls through level, interpolated, or None."""
+    below = np.flatnonzero((values[:-1] >= level) & (values[1:] < level))
+    if len(below) == 0:
+        return None
+    k = below[0]
+    fraction = (values[k] - level) / (values[k] - values[k + 1])
+    return frequencies[k] + fraction * (frequencies[k + 1] - frequencies[k])
+
+
+def step_response(A, dt, duration=window * 100, block=512):
+    """
+    Overshoot and 2% settling time of the linear arm let go from an error
+    (of any size: it's linear), from the eigenvalues of A, or by stepping it
+    if they're too close to repeated to be used.  Stepping goes a block of
+    steps at a time, through powers of A, rather than one step at a time.
+    """
+    x = np.zeros(len(A))
+    x[0], x[3] = 1, -1 # at the setpoint plus one, and the PID has seen it
+    values, vectors = np.linalg.eig(A)
+    n = int(duration / dt)
+    if np.linalg.cond(vectors) < 1e8:
+        weights = vectors[0] * np.linalg.solve(vectors, x.astype(complex))
+        # No further than the slowest pole takes to be well within 2%.
+        slowest = np.abs(values).max()
+        if 0 < slowest < 1:
+            n = min(n, int(math.log(0.001 / np.abs(weights).sum()) / math.log(slowest)) + 1)
+        positions = (np.power.outer(values, np.arange(n + 1)).T @ weights).real
+    else:
+        # columns[:, k] is A^k x for k < block, and row is the position row of A^(j*block).
+        columns = np.empty((len(A), block))
+        for k in range(block):
+            columns[:, k] = x
+            x = A @ x
+        jump = np.linalg.matrix_power(A, block)
+        row = np.eye(len(A))[0]
+        positions = np.empty((n + block) // block * block)
+        for j in range(0, len(positions), block):
+            positions[j:j + block] = row @ columns
+            row = row @ jump
+        positions = positions[:n + 1]
+    outside = np.flatnonzero(np.abs(positions) > 0.02)
+    return dict(overshoot=float(max(0, -positions.min())),
+        settling_time=float((outside[-1] + 1) * dt) if len(outside) else 0.0)
+
+
+# Below this damping ratio the arm is as good as undamped: hanging below the
+# axle with no control, it swings for minutes.
+marginal_damping = 0.01
+
+
+def stability(process, dt=1.0 / update_frequency):
+    """
+    The linear pre-check of process as configured, as a dict: whether the
+    closed loop is stable and the output can hold the arm at the setpoint,
+    whether it's only marginally so (damping ratio under marginal_damping),
+    the poles (as z), the damping ratio and natural frequency (Hz) of the
+    least damped pair, the overshoot and 2% settling time, steady state
+    error (radians, without an integrator), the friction band (radians),
+    gain margin (dB), phase margin (degrees) and bandwidth (Hz).  Any that
+    don't apply are None.
+    """
+    linear = Linearization(process, dt)
+    poles = np.linalg.eigvals(linear.matrix())
+    # Drop the poles at the origin: the state that's just a copy of another.
+    poles = poles[np.abs(poles) > 1e-12]
+    stable = bool(np.all(np.abs(poles) < 1 - 1e-9))
+    result = dict(stable=stable, marginal=False, holds=bool(linear.holds), output=linear.output,
+        poles=[complex(pole) for pole in poles],
+        damping_ratio=None, natural_frequency=None, overshoot=None, settling_time=None,
+        steady_state_error=None, friction_band=None, gain_margin=None, phase_margin=None, bandwidth=None)
+
+    gain = linear.d_output * linear.p
+    if not linear.integrating and gain > 0:
+        # Proportional droop: the error at which p makes up the difference from f.
+        result['steady_state_error'] = (linear.output - linear.f_output) / linear.p
+    if gain > 0:
+        result['friction_band'] = linear.friction / gain
+
+    if len(poles) and stable:
+        s = np.log(poles.astype(complex)) / dt
+        natural = np.abs(s)
+        zeta = np.where(natural > 0, -s.real / np.where(natural > 0, natural, 1), 1.0)
+        k = np.argmin(zeta)
+        result.update(damping_ratio=float(zeta[k]), natural_frequency=float(natural[k] / (2 * math.pi)),
+            marginal=bool(zeta[k] < marginal_damping))
+        result.update(step_response(linear.matrix(), dt))
+
+    nyquist = 0.5 / dt
+    frequencies = np.geomspace(1e-3, nyquist * 0.999, 2000)
+    loop = linear.loop(frequencies)
+    magnitude = np.abs(loop)
+    crossover = _crossing(frequencies, magnitude, 1.0)
+    if crossover is not None:
+        result['phase_margin'] = float(180 + np.degrees(np.angle(linear.loop([crossover])[0])))
+    # Where the loop gain crosses the negative real axis inside the unit circle.
+    negative = ((loop.real[:-1] < 0) & (np.sign(loop.imag[:-1]) != np.sign(loop.imag[1:]))
+        & (magnitude[:-1] < 1))
+    if negative.any():
+        k = np.flatnonzero(negative)[0]
+        result['gain_margin'] = float(-20 * math.log10((magnitude[k] + magnitude[k + 1]) / 2))
+    if stable:
+        closed = np.abs(loop / (1 + loop))
+        result['bandwidth'] = _crossing(frequencies, closed, closed[0] / math.sqrt(2))
+    return result
+
+
+def describe(result):
+    """stability(), as a line of text."""
+    if not result['holds']:
+        return "Linear: the motor can't hold the arm at the setpoint"
+    if not result['stable']:
+        return "Linear: unstable at the setpoint"
+    parts = ["Linear: marginal, barely damped" if result['marginal'] else "Linear: stable"]
+    if result['damping_ratio'] is not None:
+        parts.append(f"ζ={result['damping_ratio']:.2f}, overshoot≈{result['overshoot']:.0%}")
+    if result['settling_time'] is not None:
+        parts.append(f"settling≈{result['settling_time']:.1f}s")
+    if result['steady_state_error'] is not None:
+        parts.append(f"droop≈{radians_to_degrees(result['steady_state_error']):.1f}º")
+    if result['friction_band'] is not None:
+        parts.append(f"friction band ±{radians_to_degrees(result['friction_band']):.2f}º")
+    if result['gain_margin'] is not None:
+        parts.append(f"GM {result['gain_margin']:.1f}dB")
+    if result['phase_margin'] is not None:
+        parts.append(f"PM {result['phase_margin']:.0f}º")
+    if result['bandwidth'] is not None:
+        parts.append(f"bandwidth {result['bandwidth']:.2f}Hz")
+    return ", ".join(parts)
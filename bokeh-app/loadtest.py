@@ -0,0 +1,64 @@
+import sys
+from time import perf_counter, sleep
+
+from bokeh.document import Document
+
+from constants import update_frequency, frame_rate
+from session import scheduler
+from traffic import TrafficMeter
+
+# How many sessions can one server process keep up with?  Builds N sessions
+# as the server would, then times the shared scheduler tick and every
+# session's dashboard callback, and the bytes each session sends.  Run with:
+#
+#   python loadtest.py [sessions...]
+
+def measure(n, seconds=2.0):
+    import main
+    del scheduler.sessions[:]
+    docs = []
+    for _ in range(n):
+        doc = Document()
+        main.bkapp(doc)
+        docs.append(doc)
+    dashboards = [cb.callback for doc in docs for cb in doc.session_callbacks
+        if cb.period == 1000.0 / frame_rate]
+
+    scheduler.tick() # warm up, e.g. numba compiling the kernel
+
+    ticks = int(seconds * update_frequency)
+    frames = int(seconds * frame_rate)
+    tick_time = frame_time = 0
+    for k in range(ticks):
+        start = perf_counter()
+        scheduler.tick()
+        tick_time += perf_counter() - start
+        if k % (update_frequency // frame_rate) == 0:
+            start = perf_counter()
+            for dashboard in dashboards:
+                dashboard()
+            frame_time += perf_counter() - start
+        sleep(max(0, 1.0 / update_frequency - (perf_counter() - start)))
+    # CPU seconds needed per second of wall time
+    load = (tick_time + frame_time) / seconds
+
+    # Then the bytes each session sends, metered separately as metering isn't free.
+    meters = [TrafficMeter(doc) for doc in docs]
+    for k in range(ticks):
+        scheduler.tick()
+        if k % (update_frequency // frame_rate) == 0:
+            for dashboard in dashboards:
+                dashboard()
+        sleep(1.0 / update_frequency)
+    traffic = sum(meter.rate()[0] for meter in meters) / n
+    return dict(sessions=n, tick_ms=1000 * tick_time / ticks, frame_ms=1000 * frame_time / frames, load=load,
+        bytes_per_second=traffic)
+
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [1, 10, 30]
+    for n in counts:
+        result = measure(n)
+        print(f"{result['sessions']:4} sessions: tick {result['tick_ms']:7.2f}ms, frame {result['frame_ms']:7.2f}ms, "
+            f"load {result['load']:.0%} of one core, about {int(n / result['load'])} sessions sustainable, "
+            f"{result['bytes_per_second'] / 1000:.1f} kB/s per session")
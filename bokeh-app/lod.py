@@ -0,0 +1,121 @@
+import numpy as np
+
+# Level of detail for long histories.  A Pyramid keeps the samples of some
+# columns at several resolutions: level 0 holds the samples themselves, and
+# each level above holds the min and max of every factor items of the level
+# below.  Every level has the same capacity, so memory is fixed while the
+# history kept grows by factor with each level.
+#
+# A query asks for a time range and a number of points, and gets the finest
+# level covering the range in no more than that many points.  Each item is
+# drawn as two points, (start, min) and (end, max).  (Full M4 would also keep
+# each bucket's first and last values in order, but the columns here share
+# one x axis, so their extremes can't each be put at their own time.)
+
+
+class Level:
+    """A ring of items, each the time span and the min and max of each column over some samples."""
+    def __init__(self, columns, capacity):
+        self.columns = columns
+        self.capacity = capacity
+        self.start = np.zeros(capacity)
+        self.end = np.zeros(capacity)
+        self.low = { column: np.zeros(capacity) for column in columns }
+        self.high = { column: np.zeros(capacity) for column in columns }
+        self.count = 0 # items ever added
+
+    def extend(self, start, end, low, high):
+        n = len(start)
+        indices = np.arange(self.count, self.count + n) % self.capacity
+        self.start[indices] = start
+        self.end[indices] = end
+        for column in self.columns:
+            self.low[column][indices] = low[column]
+            self.high[column][indices] = high[column]
+        self.count += n
+
+    @property
+    def first(self):
+        """The oldest item still kept."""
+        return max(0, self.count - self.capacity)
+
+    def items(self, first, last):
+        """Ring indices of items first to last (counting every item ever added)."""
+        return np.arange(first, last) % self.capacity
+
+    def find(self, time):
+        """The first kept item ending at or after time."""
+        ends = self.end[self.items(self.first, self.count)]
+        return self.first + int(np.searchsorted(ends, time))
+
+
+class Pyramid:
+    def __init__(self, columns, capacity, levels=7, factor=4, x='ts'):
+        self.columns = list(columns)
+        self.x = x
+        self.factor = factor
+        self.levels = [Level(self.columns, capacity) for _ in range(levels)]
+
+    def append(self, segment):
+        """Add samples, as a dict of arrays including the x column."""
+        values = { column: segment[column] for column in self.columns }
+        self.levels[0].extend(segment[self.x], segment[self.x], values, values)
+        for below, above in zip(self.levels, self.levels[1:]):
+            first = above.count * self.factor
+            n = (below.count - first) // self.factor
+            if n == 0:
+                break
+            items = below.items(first, first + n * self.factor)
+            shape = (n, self.factor)
+            above.extend(below.start[items].reshape(shape)[:, 0], below.end[items].reshape(shape)[:, -1],
+                { column: below.low[column][items].reshape(shape).min(axis=1) for column in self.columns },
+                { column: below.high[column][items].reshape(shape).max(axis=1) for column in self.columns })
+
+    @property
+    def latest(self):
+        level = self.levels[0]
+        return level.end[(level.count - 1) % level.capacity] if level.count else 0
+
+    def choose(self, start, end, points):
+        """
+        (level, first, last): the finest level with the items from start to
+        end (in x) in at most about points rows, and which items those are.
+        None if there's nothing yet.  last is only ever a complete item.
+        """
+        chosen = None
+        for index, level in enumerate(self.levels):
+            if level.count == 0:
+                break
+            first, last = level.find(start), min(level.find(end) + 1, level.count)
+            chosen = index, first, last
+            covers = level.first == 0 or level.start[level.first % level.capacity] <= start
+            if covers and (last - first) * self.rows_per_item(index) <= points:
+                break
+        return chosen
+
+    def rows_per_item(self, index):
+        return 1 if index == 0 else 2
+
+    def rows(self, index, first, last):
+        """Items first to last of a level, as rows to plot: a dict of arrays."""
+        level = self.levels[index]
+        items = level.items(max(first, level.first), last)
+        if index == 0:
+            rows = { column: level.low[column][items] for column in self.columns }
+            rows[self.x] = level.start[items]
+            return rows
+        # Interleave each item's (start, low) with its (end, high).
+        rows = { column: np.column_stack([level.low[column][items], level.high[column][items]]).ravel()
+            for column in self.columns }
+        rows[self.x] = np.column_stack([level.start[items], level.end[items]]).ravel()
+        return rows
+
+    def query(self, start, end, points):
+        """
+        Rows to plot from start to end (in x) in at most about points rows,
+        as a dict of arrays, from the finest level that has them.
+        """
+        chosen = self.choose(start, end, points)
+        if chosen is None:
+            return { column: np.zeros(0) for column in self.columns + [self.x] }
+        return self.rows(*chosen)
@@ -1,30 +1,42 @@
+import os
 import math
 import itertools
+import numpy as np
+from functools import partial
+from time import time
 
 from bokeh.layouts import column, row
-from bokeh.models import ColumnDataSource, Slider, Button, Span, Arrow, NormalHead, Tooltip, HelpButton, HoverTool, LinearAxis, NumericInput, Spinner, Select, Paragraph, DataTable, TableColumn, Div
+from bokeh.models import ColumnDataSource, WheelZoomTool, ColorBar, Slider, Button, RadioButtonGroup, Toggle, PreText, Span, Arrow, NormalHead, Tooltip, HelpButton, HoverTool, LinearAxis, NumericInput, Spinner, Select, Paragraph, DataTable, TableColumn, NumberFormatter, Div
 from bokeh.plotting import figure
 from bokeh.themes import Theme
 from bokeh.io import show, output_notebook
 from bokeh.plotting import figure, curdoc
-from bokeh.driving import linear
 from bokeh.models.ranges import DataRange1d, Range1d
 from bokeh.core.properties import value
-from bokeh.palettes import Category10_10 as palette
+from bokeh.palettes import Category10_10 as palette, Viridis256
+from bokeh.transform import linear_cmap
+from bokeh.events import RangesUpdate
 
-from process import Process
+from process import Process, control_callbacks, configure, defaults
 from math_util import input_modulus, radians_to_degrees, degrees_to_radians
 from motor import Motor
-from constants import frame_rate, window, update_frequency
-from simulation import simulate
+from constants import frame_rate, window, update_frequency, physics_frequency
+from simulation import simulate, Cancelled
+from robustness import robustness
+from optimize import optimize, cost
+import linear
+from stabilitymap import StabilityMap
+import hardware
+from telemetry import TelemetryBuffer
+from recording import TraceWriter
+from replay import open_trace, Replay
+from lod import Pyramid
+from traffic import TrafficMeter
+import diagnostics
+from session import Session, scheduler, executor, results, maps, log
+import cache
 
 
-def get_empty_data(process, controls):
-    return { key: [] for key in (process.columns + list(controls.keys())) }
-
-
-data = None
-
 control_help = dict(
     p="The further away you are, the harder you push",
     i="If it's taking a long time to get there, give it a nudge",
@@ -36,40 +48,22 @@ control_help = dict(
 
 def make_controls():
     return dict(
-        p=Slider(start=0., end=1, value=0., step=0.005, title="p", sizing_mode="stretch_width", format='0.000'),
-        f=Slider(start=0., end=1, value=0., step=0.005, title="f", sizing_mode="stretch_width", format='0.000'),
-        i=Slider(start=0., end=1, value=0., step=0.005, title="i", sizing_mode="stretch_width", format='0.000'),
-        d=Slider(start=0., end=1, value=0., step=0.005, title="d", sizing_mode="stretch_width", format='0.000'),
-        izone=Slider(start=0., end=90, value=20., step=1, title="izone", sizing_mode="stretch_width"),
-        setpoint=Slider(start=-180., end=180, value=0., title="setpoint", sizing_mode="stretch_width"),
-        ratio=Spinner(low=1, high=1000, value=1, title="gear ratio", sizing_mode="stretch_width"),
-        mass=NumericInput(low=0.1, high=100, value=1, mode='float', title="arm mass (kg)", sizing_mode="stretch_width"),
-        length=NumericInput(low=0.1, high=1, value=1, mode='float', title="arm length (m)", sizing_mode="stretch_width"),
-        cof=NumericInput(low=0, high=1, value=0.05, mode='float', title="coefficient of friction", sizing_mode="stretch_width"), 
-        efficiency=NumericInput(low=0, high=1, value=0.85, mode='float', title="gearbox efficiency", sizing_mode="stretch_width"),
+        p=Slider(start=0., end=1, value=defaults['p'], step=0.005, title="p", sizing_mode="stretch_width", format='0.000'),
+        f=Slider(start=0., end=1, value=defaults['f'], step=0.005, title="f", sizing_mode="stretch_width", format='0.000'),
+        i=Slider(start=0., end=1, value=defaults['i'], step=0.005, title="i", sizing_mode="stretch_width", format='0.000'),
+        d=Slider(start=0., end=1, value=defaults['d'], step=0.005, title="d", sizing_mode="stretch_width", format='0.000'),
+        izone=Slider(start=0., end=90, value=defaults['izone'], step=1, title="izone", sizing_mode="stretch_width"),
+        setpoint=Slider(start=-180., end=180, value=defaults['setpoint'], title="setpoint", sizing_mode="stretch_width"),
+        ratio=Spinner(low=1, high=1000, value=defaults['ratio'], title="gear ratio", sizing_mode="stretch_width"),
+        mass=NumericInput(low=0.1, high=100, value=defaults['mass'], mode='float', title="arm mass (kg)", sizing_mode="stretch_width"),
+        length=NumericInput(low=0.1, high=1, value=defaults['length'], mode='float', title="arm length (m)", sizing_mode="stretch_width"),
+        cof=NumericInput(low=0, high=1, value=defaults['cof'], mode='float', title="coefficient of friction", sizing_mode="stretch_width"), 
+        efficiency=NumericInput(low=0, high=1, value=defaults['efficiency'], mode='float', title="gearbox efficiency", sizing_mode="stretch_width"),
         motor=Select(options=list(Motor.motors.keys()), title="motor", sizing_mode="stretch_width",
-            value=list(Motor.motors.keys())[0]),
-        n_motors=Spinner(low=1, high=3, value=1, title="number of motors", sizing_mode="stretch_width"),   
+            value=defaults['motor']),
+        n_motors=Spinner(low=1, high=3, value=defaults['n_motors'], title="number of motors", sizing_mode="stretch_width"),   
     )
 
-control_callbacks = dict(
-    # P, I, and D are all per-radian so can be passed on directly.
-    p=lambda process, value: process.pid.set_p(value),
-    i=lambda process, value: process.pid.set_i(value),
-    d=lambda process, value: process.pid.set_d(value),
-    f=lambda process, value: process.set_f(value),
-    izone=lambda process, value: process.pid.set_izone(degrees_to_radians(value)),
-    setpoint=lambda process, value: process.pid.set_setpoint(degrees_to_radians(value)),
-    ratio=lambda process, value: process.model.motor.set_ratio(value),
-    mass=lambda process, value: process.model.set_mass(value),
-    length=lambda process, value: process.model.set_length(value),
-    cof=lambda process, value: process.model.bearing.set_cof(value),
-    efficiency=lambda process, value: process.model.motor.set_efficiency(value),
-    motor=lambda process, value: process.model.motor.set_motor(Motor.get_by_name(value)),
-    n_motors=lambda process, value: process.model.motor.set_n_motors(value),
-)
-
-
 def connect_controls(process, controls):
     def wrapper(callback):
         return lambda attr, old, new: callback(process, new)
@@ -96,6 +90,8 @@ def make_line_chart(title, source, lines, spans=[0]):
         if 'color' not in data:
             data['color'] = next(colors)
         p.line(**data)
+    # Lines from other sources (e.g. the setpoint) don't stretch the x axis.
+    p.x_range = DataRange1d(renderers=[renderer for renderer in p.renderers if renderer.data_source is source])
     p.renderers.extend([
         Span(location=y, line_color='black', line_width=1)
         for y in spans])
@@ -114,6 +110,7 @@ def make_line_chart(title, source, lines, spans=[0]):
     ])
     p.toolbar.logo = None
     p.toolbar_location = None   
+    p.select_one({'type': WheelZoomTool}).dimensions = 'width' # made active for long histories
     for y_range in y_ranges:
         if 1== len(p.extra_y_ranges[y_range].renderers):
             color = p.extra_y_ranges[y_range].renderers[0].glyph.line_color
@@ -159,25 +156,30 @@ def make_animation_chart(source):
     return p
 
 
-def bkapp(doc):
-    process = Process()
-    controls = make_controls()
-    trigger_control_callbacks(process, controls)
-    connect_controls(process, controls)
+def make_stability_chart(source, gains_source):
+    """Settling time over (p, d) as cells from a StabilityMap, and the current gains."""
+    p = figure(width=300, height=200, title="Stability map", x_range=Range1d(0, 1), y_range=Range1d(0, 1),
+        x_axis_label="p", y_axis_label="d", tools="hover", tooltips=[("p", "@p0{0.000}-@p1{0.000}"),
+            ("d", "@d0{0.000}-@d1{0.000}"), ("settling time", "@settling_time{0.00}s")])
+    # Cells that don't settle have no settling time, so are drawn in the nan colour.
+    color = linear_cmap('settling_time', Viridis256, low=0, high=window / 2, nan_color='firebrick')
+    cells = p.quad(left='p0', right='p1', bottom='d0', top='d1', fill_color=color, line_color=None, source=source)
+    p.add_layout(ColorBar(color_mapper=color['transform'], width=8, title="s"), 'right')
+    p.scatter(x='p', y='d', marker='cross', size=12, line_width=2, color='white', source=gains_source)
+    p.select_one({'type': HoverTool}).renderers = [cells]
+    p.toolbar.logo = None
+    p.toolbar_location = None
+    return p
 
-    global data
-    data = get_empty_data(process, controls)
 
-    source = ColumnDataSource(data)
-    animation_source = ColumnDataSource(dict(
-        setpoint_x=[],
-        setpoint_y=[],
-        position_x=[],
-        position_y=[],
-    ))
+def cell_data(cells):
+    return { column: np.array([cell[column] if cell[column] is not None else np.nan for cell in cells], dtype=float)
+        for column in ['p0', 'p1', 'd0', 'd1', 'settling_time'] }
+
 
+def make_dashboard_charts(source, setpoint_source=None):
     p_mechanics = make_line_chart(title="Mechanics", source=source, lines=[
-        dict(y='setpoint', color="firebrick", legend_label="setpoint"),
+        dict(y='setpoint', color="firebrick", legend_label="setpoint", source=setpoint_source or source),
         dict(y="position_deg", color="navy", legend_label="position"),
         dict(y="velocity_deg", legend_label="velocity", y_range_name="velocity"),
         dict(y="acceleration_deg", legend_label="acceleration", y_range_name="acceleration"),
@@ -205,71 +207,544 @@ def bkapp(doc):
         dict(y='err_acc', legend_label="accumulated error (radian-secs)", y_range_name='accumulated error')
     ])
 
+    return p_mechanics, p_voltage, p_torque, p_pid
+
+
+def make_animation_source():
+    return ColumnDataSource(dict(
+        setpoint_x=[],
+        setpoint_y=[],
+        position_x=[],
+        position_y=[],
+    ))
+
+
+def update_animation(animation_source, setpoint, position):
+    setpoint_rad = degrees_to_radians(setpoint)
+    animation_data = dict(
+        setpoint_x=[math.cos(setpoint_rad)],
+        setpoint_y=[math.sin(setpoint_rad)],
+        position_x=[math.cos(position)],
+        position_y=[math.sin(position)]
+    )        
+    animation_source.stream(animation_data, 1)
+
+
+def plotted_columns(charts, source):
+    """The columns of source the charts draw, x first."""
+    columns = ['ts']
+    for p in charts:
+        for renderer in p.renderers:
+            if getattr(renderer, 'data_source', None) is source and renderer.glyph.y not in columns:
+                columns.append(renderer.glyph.y)
+    return columns
+
+
+def float32(data):
+    # Plenty for the charts, and half the bytes on the wire.
+    return { column: np.asarray(values, dtype=np.float32) for column, values in data.items() }
+
+
+def step_changes(data, column):
+    """The rows of data where column starts or stops a run of the same value: enough to draw it."""
+    values = data[column]
+    keep = np.flatnonzero((np.diff(values, prepend=np.nan) != 0) | (np.diff(values, append=np.nan) != 0))
+    return { key: array[keep] for key, array in data.items() }
+
+
+# Choices of how much history the charts show.  Beyond the window they are
+# drawn from a level-of-detail pyramid, at about two points per pixel.
+histories = { "30 s": window, "5 min": 300, "30 min": 1800, "3 h": 10800 }
+
+
+def bkapp(doc, show_diagnostics=False):
+    process = Process(physics_frequency=physics_frequency)
+    controls = make_controls()
+    trigger_control_callbacks(process, controls)
+    connect_controls(process, controls)
+
+    # The latest (numeric) control values, kept up to date rather than read every sample.
+    control_values = { key: widget.value for key, widget in controls.items() if key != 'motor' }
+    def track(key):
+        def callback(attr, old, new):
+            control_values[key] = new
+        return callback
+    for key in control_values.keys():
+        controls[key].on_change("value", track(key))
+
+    buffer = TelemetryBuffer(process.columns + list(control_values.keys()), int(update_frequency*window))
+    session = Session(process, buffer, control_values)
+    # Set ARM_TRACE_DIR to record each session's telemetry there.
+    trace = None
+    if os.environ.get('ARM_TRACE_DIR'):
+        trace = TraceWriter(os.path.join(os.environ['ARM_TRACE_DIR'], f"session-{time():.0f}-{id(process):x}.arrow"),
+            process.columns, extra=control_values, block=False)
+        process.set_trace(trace)
+    for widget in controls.values():
+        widget.on_change("value", lambda attr, old, new: session.touch())
+    source = ColumnDataSource(buffer.empty())
+    # The setpoint rarely changes, so it's sent only when it does (and once a
+    # second to keep its line up to date), rather than with every sample.
+    setpoint_source = ColumnDataSource(float32(dict(ts=[], setpoint=[])))
+    animation_source = make_animation_source()
+
+    p_mechanics, p_voltage, p_torque, p_pid = make_dashboard_charts(source, setpoint_source)
+    charts = [p_mechanics, p_voltage, p_torque, p_pid]
+    # Only what's drawn goes to the browser.
+    source.data = float32({ column: [] for column in plotted_columns(charts, source) })
+    pyramid = Pyramid(list(source.data.keys())[1:] + ['setpoint'], int(update_frequency*window))
+
     p_animation = make_animation_chart(animation_source)
 
     # p_table = DataTable(source=source,
     #     columns=[TableColumn(field=x) for x in source.data.keys()], sizing_mode="stretch_width")
 
+    # Shown while the scheduler has suspended this session for being idle.
+    paused_button = Button(label="Paused — click to resume", button_type="warning", visible=False,
+        sizing_mode="stretch_width")
+    paused_button.on_click(session.touch)
+
     reset_button = Button(label="Reset Arm", sizing_mode="stretch_width")
     reset_button.on_click(lambda: process.reset())
+    reset_button.on_click(session.touch)
 
     reflect_button = Button(label="Reflect Setpoint", sizing_mode="stretch_width")
     def reflect():
         controls['setpoint'].value = input_modulus(180 - controls['setpoint'].value, -180, 180)
     reflect_button.on_click(reflect)
 
+    # The linear pre-check, redone on every change; Analyze confirms it by simulation.
+    precheck_widget = Paragraph()
+    precheck_process = Process(now=0)
+    def precheck():
+        configure(precheck_process, { key: widget.value for key, widget in controls.items() })
+        precheck_widget.text = linear.describe(linear.stability(precheck_process))
+    for widget in controls.values():
+        widget.on_change("value", lambda attr, old, new: precheck())
+    precheck()
+
     analysis_widget = Paragraph()
     analyze_button = Button(label="Analyze", sizing_mode="stretch_width")
-    def analyze():
-        analysis_widget.text="Simulating...."
-        result = simulate(
-            process_init=lambda process: trigger_control_callbacks(process, controls),
-            initial_position=-math.pi/2,
-        )
-        #print(result)
+    analysis = dict(run=0, reported=0, robustness=0, hardware=0)
+
+    def describe(result):
         if result['settled']:
-            text = f"Overshoot={result['overshoot']:.2%}, 2% Settling Time={result['settling_time']:.2f}s, Steady State Error={result['steady_state_error']:.2%}" 
+            return f"Overshoot={result['overshoot']:.2%}, 2% Settling Time={result['settling_time']:.2f}s, Steady State Error={result['steady_state_error']:.2%}" 
+        elif result.get('detector') not in [None, 'at_rest']:
+            return f"Process did not settle ({result['detector'].replace('_', ' ')})"
         else:
-            text = "Process did not settle"
-        #text = text + " :- " + str(result) # debug only
-        analysis_widget.text = text
-    analyze_button.on_click(analyze)
-
-    #@linear()
-    def update_data():
-        global data
-        for key, widget in controls.items():
-            data[key].append(widget.value)
-
-        process_result = process.update()
-        for key, value in process_result.items():
-            data[key].append(value)
+            return "Process did not settle"
 
+    def show_analysis(run, text):
+        # Results from a superseded run are dropped.
+        if run == analysis['run']:
+            analysis_widget.text = text
 
-    def update_animation(setpoint, position):
-        setpoint_rad = degrees_to_radians(setpoint)
-        animation_data = dict(
-            setpoint_x=[math.cos(setpoint_rad)],
-            setpoint_y=[math.sin(setpoint_rad)],
-            position_x=[math.cos(position)],
-            position_y=[math.sin(position)]
-        )        
-        animation_source.stream(animation_data, 1)
+    def analyze():
+        # Bumping the run number cancels any analysis already in progress.
+        analysis['run'] += 1
+        run = analysis['run']
+        analysis_widget.text="Simulating...."
+        values = { key: widget.value for key, widget in controls.items() }
+        initial_position = -math.pi/2
+        key = cache.key(values, initial_position)
+
+        def progress(sim_time, error):
+            if run != analysis['run']:
+                raise Cancelled()
+            now = time()
+            if now - analysis['reported'] > 1.0 / frame_rate:
+                analysis['reported'] = now
+                doc.add_next_tick_callback(partial(show_analysis, run,
+                    f"Simulating.... t={sim_time:.0f}s, error={radians_to_degrees(error):.2f}º"))
+
+        def work():
+            # The cache may be on disk, so it's looked up here, off the event loop.
+            result = results.get(key)
+            if result is not None:
+                doc.add_next_tick_callback(partial(show_analysis, run, describe(result)))
+                return
+            try:
+                result = simulate(
+                    process_init=lambda process: configure(process, values),
+                    initial_position=initial_position,
+                    progress=progress,
+                )
+            except Cancelled:
+                return
+            except Exception as e:
+                log.exception("Analyze failed")
+                doc.add_next_tick_callback(partial(show_analysis, run, f"Analysis failed: {e}"))
+                return
+            results.put(key, result)
+            #print(result)
+            text = describe(result)
+            #text = text + " :- " + str(result) # debug only
+            doc.add_next_tick_callback(partial(show_analysis, run, text))
+
+        executor.submit(work)
+    analyze_button.on_click(analyze)
 
+    analyze_button.on_click(session.touch)
+
+    robustness_widget = Div(sizing_mode="stretch_width")
+    robustness_button = Button(label="Robustness", sizing_mode="stretch_width")
+
+    def describe_robustness(report):
+        lines = [f"{report['runs']} runs from random positions, with mass, length and friction varied: "
+            f"{report['unsettled']:.0%} did not settle."]
+        for name, objective, format in [("Overshoot", 'overshoot', '.2%'), ("2% Settling Time", 'settling_time', '.2f'),
+                ("Steady State Error", 'steady_state_error', '.2%')]:
+            stats = report[objective]
+            if stats is not None:
+                lines.append(f"{name}: " + ", ".join(f"{x}={stats[x]:{format}}" for x in ['p50', 'p95', 'max']))
+        return "<br>".join(lines)
+
+    def show_robustness(run, text):
+        if run == analysis['robustness']:
+            robustness_widget.text = text
+
+    def analyze_robustness():
+        analysis['robustness'] += 1
+        run = analysis['robustness']
+        robustness_widget.text = "Simulating...."
+        values = { key: widget.value for key, widget in controls.items() }
+
+        def work():
+            # One worker: the batches are vectorized already, and the server's
+            # cores are shared with everyone else's sessions.
+            try:
+                report = robustness(values, runs=64, workers=1)
+            except Exception as e:
+                log.exception("Robustness failed")
+                doc.add_next_tick_callback(partial(show_robustness, run, f"Robustness failed: {e}"))
+                return
+            doc.add_next_tick_callback(partial(show_robustness, run, describe_robustness(report)))
+
+        executor.submit(work)
+    robustness_button.on_click(analyze_robustness)
+    robustness_button.on_click(session.touch)
+
+    suggest_button = Button(label="Suggest gains", sizing_mode="stretch_width")
+
+    def rounded(gains):
+        """As the controls would hold them."""
+        return { gain: round(value) if gain == 'izone' else round(value, 3) for gain, value in gains.items() }
+
+    def apply_gains(run, gains, text):
+        if run == analysis['run']:
+            for gain, value in gains.items():
+                controls[gain].value = value
+            analysis_widget.text = text
+
+    def suggest():
+        # Shares the run number with Analyze, as both report in analysis_widget.
+        analysis['run'] += 1
+        run = analysis['run']
+        analysis_widget.text = "Searching...."
+        values = { key: widget.value for key, widget in controls.items() }
+        start = { gain: values.pop(gain) for gain in ['f', 'p', 'i', 'd', 'izone'] }
+
+        def progress(generation, best):
+            if run != analysis['run']:
+                raise Cancelled()
+            doc.add_next_tick_callback(partial(show_analysis, run,
+                f"Searching.... generation {generation}, best cost {best['cost']:.3f}"))
+
+        def work():
+            try:
+                # One worker, as for robustness.
+                best = optimize(values, start=start, workers=1, progress=progress)
+                # The controls round the gains, so report what the rounded ones do.
+                gains = rounded(best['gains'])
+                result = simulate(lambda process: configure(process, {**values, **gains}), -math.pi/2)
+            except Cancelled:
+                return
+            except Exception as e:
+                log.exception("Suggest failed")
+                doc.add_next_tick_callback(partial(show_analysis, run, f"Search failed: {e}"))
+                return
+            doc.add_next_tick_callback(partial(apply_gains, run, gains,
+                f"Suggested after {best['evaluations']} simulations (cost {cost(result):.3f}): " + describe(result)))
+
+        executor.submit(work)
+    suggest_button.on_click(suggest)
+    suggest_button.on_click(session.touch)
+
+    # Every motor, ratio and number of motors on this arm, ranked as they finish.
+    hardware_button = Button(label="Compare hardware", sizing_mode="stretch_width")
+    hardware_widget = Div(sizing_mode="stretch_width")
+    hardware_columns = ['motor', 'ratio', 'n_motors', 'f', 'p', 'i', 'd', 'izone', 'settling_time', 'overshoot',
+        'steady_state_error']
+    hardware_source = ColumnDataSource({ column: [] for column in hardware_columns })
+    number = NumberFormatter(format='0.000')
+    percent = NumberFormatter(format='0.0%')
+    hardware_table = DataTable(source=hardware_source, height=200, sizing_mode="stretch_width", visible=False,
+        index_position=None, sortable=False, columns=[
+            TableColumn(field='motor', title="motor", width=150),
+            TableColumn(field='ratio', title="ratio"),
+            TableColumn(field='n_motors', title="motors"),
+            *[TableColumn(field=gain, title=gain, formatter=number) for gain in ['f', 'p', 'i', 'd']],
+            TableColumn(field='settling_time', title="settling time (s)", formatter=NumberFormatter(format='0.00')),
+            TableColumn(field='overshoot', title="overshoot", formatter=percent),
+            TableColumn(field='steady_state_error', title="steady state error", formatter=percent),
+        ])
+    hardware_results = []
+
+    def show_hardware(run, result, total):
+        if run != analysis['hardware']:
+            return
+        hardware_results.append(result)
+        # Ranked afresh each time: the table is short, and one update is as cheap as a stream.
+        ranked = [result for result in hardware.rank(hardware_results) if result['cost'] is not None]
+        hardware_source.data = { column: [result.get(column) for result in ranked] for column in hardware_columns }
+        unable = len(hardware_results) - len(ranked)
+        hardware_widget.text = (f"{len(hardware_results)} of {total} combinations" +
+            (f", {unable} too weak to hold the arm level" if unable else "") +
+            ("; select one to use it" if len(hardware_results) == total else ""))
+
+    def show_hardware_error(run, text):
+        if run == analysis['hardware']:
+            hardware_widget.text = text
+
+    def compare_hardware():
+        analysis['hardware'] += 1
+        run = analysis['hardware']
+        hardware_results.clear()
+        hardware_source.data = { column: [] for column in hardware_columns }
+        hardware_source.selected.indices = []
+        hardware_table.visible = True
+        hardware_widget.text = "Simulating...."
+        values = { key: widget.value for key, widget in controls.items() }
+        combinations = hardware.combinations()
+
+        def progress():
+            if run != analysis['hardware']:
+                raise Cancelled()
+
+        def work():
+            # One worker, as for robustness; results are shared through the cache.
+            try:
+                for result in hardware.sweep(values, combinations, workers=1, results=results, progress=progress):
+                    doc.add_next_tick_callback(partial(show_hardware, run, result, len(combinations)))
+            except Cancelled:
+                return
+            except Exception as e:
+                log.exception("Hardware comparison failed")
+                doc.add_next_tick_callback(partial(show_hardware_error, run, f"Hardware comparison failed: {e}"))
+
+        executor.submit(work)
+    hardware_button.on_click(compare_hardware)
+    hardware_button.on_click(session.touch)
+
+    def use_hardware(attr, old, new):
+        if new:
+            chosen = { column: hardware_source.data[column][new[0]] for column in hardware_columns[:8] }
+            for key, value in chosen.items():
+                if value is not None:
+                    controls[key].value = round(value, 3) if key in ['f', 'p', 'i', 'd'] else value
+    hardware_source.selected.on_change('indices', use_hardware)
+
+    # The stability map for the arm and the other gains, made only while it's
+    # shown (and shared with other sessions showing the same one), redrawn as
+    # cells finish, and remade (after a pause, as sliders move) when they change.
+    stability_source = ColumnDataSource(cell_data([]))
+    gains_source = ColumnDataSource(dict(p=[controls['p'].value], d=[controls['d'].value]))
+    p_stability = make_stability_chart(stability_source, gains_source)
+    p_stability.visible = False
+    stability_toggle = Toggle(label="Stability map", active=False, sizing_mode="stretch_width")
+    stability = dict(run=0, unsubscribe=None)
+
+    def show_cells(run, cells, done, error):
+        if run == stability['run']:
+            stability_source.stream(cell_data(cells))
+            p_stability.title.text = (f"Stability map (failed: {error})" if error is not None else
+                "Stability map" if done else "Stability map (simulating....)")
+
+    def stop_map():
+        stability['run'] += 1
+        if stability['unsubscribe'] is not None:
+            stability['unsubscribe']()
+            stability['unsubscribe'] = None
+        stability_source.data = cell_data([])
+
+    def map_stability(run):
+        if run != stability['run'] or not stability_toggle.active:
+            return
+        values = { key: widget.value for key, widget in controls.items() if key not in ['p', 'd'] }
+        stability_map = StabilityMap(values)
+        key = cache.key(values, stability_map.initial_position, stability_map=stability_map.options)
+        p_stability.title.text = "Stability map (simulating....)"
+        # Called from the worker, which also looks in the cache.
+        listener = lambda cells, done, error: doc.add_next_tick_callback(partial(show_cells, run, cells, done, error))
+        stability['unsubscribe'] = maps.subscribe(key, stability_map, listener)
+
+    def arm_changed(attr, old, new):
+        stop_map()
+        if stability_toggle.active:
+            doc.add_timeout_callback(partial(map_stability, stability['run']), 500)
+    for key, widget in controls.items():
+        if key not in ['p', 'd']:
+            widget.on_change("value", arm_changed)
+    def gains_changed(attr, old, new):
+        gains_source.data = dict(p=[controls['p'].value], d=[controls['d'].value])
+    controls['p'].on_change("value", gains_changed)
+    controls['d'].on_change("value", gains_changed)
+
+    def toggle_stability(active):
+        p_stability.visible = active
+        stop_map()
+        map_stability(stability['run'])
+    stability_toggle.on_click(toggle_stability)
+    stability_toggle.on_click(lambda active: session.touch())
+
+    def session_destroyed(session_context):
+        analysis['run'] += 1 # cancel any analysis
+        analysis['hardware'] += 1
+        stop_map()
+        scheduler.remove(session)
+        if trace is not None:
+            try:
+                trace.close()
+            except Exception:
+                log.exception("Closing the trace failed")
+    doc.on_session_destroyed(session_destroyed)
+
+
+    history = Select(options=list(histories.keys()), value="30 s", title="history", sizing_mode="stretch_width")
+    # The x range the user has panned or zoomed to, if any, and otherwise the
+    # pyramid level being streamed and how many of its items have been sent.
+    view = dict(zoomed=None, level=None, sent=0)
+    setpoint_sent = dict(value=None, frames=1)
+
+    def show(rows, steps=False):
+        setpoint_rows = dict(ts=rows.pop('ts'), setpoint=rows.pop('setpoint'))
+        source.data = float32(dict(ts=setpoint_rows['ts'], **rows))
+        setpoint_source.data = float32(step_changes(setpoint_rows, 'setpoint') if steps else setpoint_rows)
+        if len(setpoint_rows['ts']):
+            setpoint_sent['value'] = setpoint_rows['setpoint'][-1]
+
+    def stream_setpoint(segment):
+        rollover = 2 * window * frame_rate
+        ts, values = segment['ts'], segment['setpoint']
+        if setpoint_sent['value'] is None:
+            setpoint_sent['value'] = values[0]
+            setpoint_source.stream(float32(dict(ts=ts[:1], setpoint=values[:1])), rollover)
+        # Each change is drawn as a vertical step.
+        previous = np.concatenate([[setpoint_sent['value']], values[:-1]])
+        changes = np.flatnonzero(values != previous)
+        if len(changes):
+            setpoint_source.stream(float32(dict(ts=np.repeat(ts[changes], 2),
+                setpoint=np.column_stack([previous[changes], values[changes]]).ravel())), rollover)
+            setpoint_sent['value'] = values[-1]
+        elif setpoint_sent['frames'] % frame_rate == 0:
+            setpoint_source.stream(float32(dict(ts=ts[-1:], setpoint=values[-1:])), rollover)
+        setpoint_sent['frames'] += 1
+
+    def points():
+        return 2 * (p_mechanics.inner_width or 1000)
+
+    def show_latest(seconds):
+        # The last seconds of history.  Once sent, only the level's newly
+        # completed items are streamed, until the level has to change.
+        latest = pyramid.latest
+        chosen = pyramid.choose(latest - seconds, latest, points())
+        if chosen is None:
+            return
+        level, first, last = chosen
+        if level != view['level']:
+            show(pyramid.rows(level, first, last))
+        elif last > view['sent']:
+            rows = float32(pyramid.rows(level, view['sent'], last))
+            rollover = (last - first) * pyramid.rows_per_item(level)
+            setpoint_source.stream(dict(ts=rows['ts'], setpoint=rows.pop('setpoint')), rollover)
+            source.stream(rows, rollover)
+        view['level'], view['sent'] = level, last
+
+    def change_history(attr, old, new):
+        view['zoomed'] = view['level'] = None
+        for p in charts:
+            p.x_range = DataRange1d(renderers=p.x_range.renderers)
+            p.toolbar.active_scroll = p.select_one({'type': WheelZoomTool}) if histories[new] > window else None
+        if histories[new] > window:
+            show_latest(histories[new])
+        else:
+            latest = pyramid.latest
+            show(pyramid.query(latest - histories[new], latest, float('inf')), steps=True)
+    history.on_change("value", change_history)
+    history.on_change("value", lambda attr, old, new: session.touch())
+
+    def zoom(event):
+        # Looking around counts as activity, as much as moving a control.
+        session.touch()
+        if histories[history.value] > window:
+            view['zoomed'] = (event.x0, event.x1)
+            view['level'] = None
+            show(pyramid.query(event.x0, event.x1, points()))
+    for p in charts:
+        p.on_event(RangesUpdate, zoom)
+
+    frames = diagnostics.Interval('dashboard_lag', 1.0 / frame_rate)
+
+    @partial(diagnostics.timed, 'update_dashboard')
     def update_dashboard():        
-        global data
-        #print(len(data['ts']))
-        if len(data['ts']) > 0:
-            source.stream(data, int(update_frequency*window))
-            update_animation(data['setpoint'][-1], data['position'][-1])
-            data = get_empty_data(process, controls)
+        if diagnostics.enabled:
+            frames.tick()
+        if paused_button.visible != session.suspended:
+            paused_button.visible = session.suspended
+        segments = buffer.unread()
+        for segment in segments:
+            pyramid.append(segment)
+        seconds = histories[history.value]
+        if seconds <= window:
+            for segment in segments:
+                source.stream(float32({ column: segment[column] for column in source.data }), int(update_frequency*window))
+                stream_setpoint(segment)
+        elif segments and view['zoomed'] is None:
+            show_latest(seconds)
+        if segments:
+            update_animation(animation_source, buffer.last('setpoint'), buffer.last('position'))
 
     model_controls = row(*[controls[x] for x in ['motor', 'ratio', 'n_motors', 'cof', 'efficiency', 'mass', 'length']],   
         sizing_mode="stretch_width")       
     controls_column = column(*(row(
         controls[x], HelpButton(tooltip=Tooltip(content=control_help[x], position='left')), sizing_mode="stretch_width")
         for x in ['f', 'p', 'i', 'izone', 'd', 'setpoint']), 
-        model_controls, analysis_widget, sizing_mode="stretch_width")
+        model_controls, history, precheck_widget, analysis_widget, robustness_widget, hardware_widget, hardware_table, sizing_mode="stretch_width")
+
+    # Set ARM_TRAFFIC to show how much this session sends to the browser.
+    traffic = Div()
+    if os.environ.get('ARM_TRAFFIC'):
+        meter = TrafficMeter(doc)
+        def show_traffic():
+            rate, binary = meter.rate()
+            traffic.text = f"Sending {rate / 1000:.1f} kB/s, {binary:.0%} as binary buffers"
+        doc.add_periodic_callback(show_traffic, 1000)
+
+    # Timings for the whole server, shown with ?diagnostics
+    diagnostics_toggle = Toggle(label="Instrumentation", active=diagnostics.enabled, sizing_mode="stretch_width")
+    diagnostics_text = PreText(sizing_mode="stretch_width")
+    dump_button = Button(label="Dump JSON", sizing_mode="stretch_width")
+    diagnostics_panel = column(row(diagnostics_toggle, dump_button, sizing_mode="stretch_width"), diagnostics_text,
+        visible=show_diagnostics, sizing_mode="stretch_width")
+    def toggle_diagnostics(active):
+        if active:
+            diagnostics.reset()
+            diagnostics.enable()
+        else:
+            diagnostics.disable()
+    diagnostics_toggle.on_click(toggle_diagnostics)
+    def dump_diagnostics():
+        # Set ARM_DIAGNOSTICS to choose where.
+        path = os.environ.get('ARM_DIAGNOSTICS', 'diagnostics.json')
+        diagnostics.dump(path)
+        diagnostics_text.text = "\n".join(diagnostics.describe() + [results.describe(), f"Written to {path}"])
+    dump_button.on_click(dump_diagnostics)
+    if show_diagnostics:
+        def show_diagnostics_text():
+            diagnostics_toggle.active = diagnostics.enabled
+            diagnostics_text.text = "\n".join(diagnostics.describe() + [results.describe()])
+        doc.add_periodic_callback(show_diagnostics_text, 1000)
 
     footer = Div(text="""For sourcecode and (some) documentation, see <a href="https://github.com/Paradox2102/pid_demo2">github.com/Paradox2102/pid_demo2</a>""")
 
@@ -277,14 +752,70 @@ def bkapp(doc):
             column(
                 row(
                     controls_column, 
-                    column(p_animation, reset_button, reflect_button, analyze_button, sizing_mode="fixed"), 
+                    column(p_animation, paused_button, reset_button, reflect_button, analyze_button, robustness_button, suggest_button, hardware_button, stability_toggle, sizing_mode="fixed"), 
                     sizing_mode="stretch_width"
                 ), 
-                p_mechanics, p_voltage, p_torque, p_pid, footer, sizing_mode="stretch_both"))
+                p_mechanics, p_voltage, p_torque, row(p_pid, p_stability, sizing_mode="stretch_width"), traffic, diagnostics_panel, footer, sizing_mode="stretch_both"))
 
-    # Add a periodic callback to be run every 500 milliseconds
-    doc.add_periodic_callback(update_data, 1000.0 / update_frequency)
+    # The scheduler steps the process; this session just streams the results.
+    scheduler.add(session)
     doc.add_periodic_callback(update_dashboard, 1000.0 / frame_rate)
     doc.title = "PID demo"
 
-bkapp(curdoc())
\ No newline at end of file
+def replayapp(doc, path):
+    """The dashboard charts, playing back a recorded trace instead of a live Process."""
+    trace = open_trace(path)
+    replay = Replay(trace, list(dict.fromkeys(trace.columns + ['setpoint'])))
+    source = ColumnDataSource({ column: np.zeros(0) for column in replay.columns })
+    animation_source = make_animation_source()
+    p_mechanics, p_voltage, p_torque, p_pid = make_dashboard_charts(source)
+    p_animation = make_animation_chart(animation_source)
+
+    speeds = [1, 10, 100]
+    speed = RadioButtonGroup(labels=[f"{x}x" for x in speeds], active=0)
+    speed.on_change("active", lambda attr, old, new: setattr(replay, 'speed', speeds[new]))
+
+    play_button = Button(label="Pause", sizing_mode="stretch_width")
+    def play():
+        replay.playing = not replay.playing
+        play_button.label = "Pause" if replay.playing else "Play"
+    play_button.on_click(play)
+
+    seek = Slider(start=0, end=max(replay.duration, 1), value=0, step=1.0 / update_frequency,
+        title="time (s)", sizing_mode="stretch_width")
+    def on_seek(attr, old, new):
+        source.data = replay.seek(new, window)
+    # value_throttled only changes when the user drags, not when we move the slider.
+    seek.on_change("value_throttled", on_seek)
+
+    def update_dashboard():
+        rows = replay.frame()
+        if rows is None:
+            return
+        source.stream(rows, int(update_frequency*window))
+        update_animation(animation_source, rows['setpoint'][-1], rows['position'][-1])
+        seek.value = replay.position
+
+    doc.add_root(
+            column(
+                row(
+                    column(Div(text=f"Replaying <b>{os.path.basename(path)}</b>"), seek, speed, sizing_mode="stretch_width"),
+                    column(p_animation, play_button, sizing_mode="fixed"),
+                    sizing_mode="stretch_width"
+                ),
+                p_mechanics, p_voltage, p_torque, p_pid, sizing_mode="stretch_both"))
+    doc.add_periodic_callback(update_dashboard, 1000.0 / frame_rate)
+    doc.title = "PID demo replay"
+
+
+def app(doc):
+    # ?replay=name plays back a trace from ARM_TRACE_DIR instead, and
+    # ?diagnostics shows the diagnostics panel.
+    arguments = doc.session_context.request.arguments if doc.session_context is not None else {}
+    if 'replay' in arguments:
+        name = os.path.basename(arguments['replay'][0].decode())
+        replayapp(doc, os.path.join(os.environ.get('ARM_TRACE_DIR', '.'), name))
+    else:
+        bkapp(doc, show_diagnostics='diagnostics' in arguments)
+
+app(curdoc())
\ No newline at end of file
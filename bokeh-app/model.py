@@ -1,20 +1,24 @@
 import math
 from math_util import *
 from constants import g
+from integrators import get_integrator
 
 class Model:
     pass
 
 
 class ModelArm(Model):
-    def __init__(self, mass, length, motor, bearing=None):
+    def __init__(self, mass, length, motor, bearing=None, integrator='euler'):
         self.mass = mass
         self.length = length
         self.motor = motor
         self.bearing = bearing
+        self.evaluations = 0
+        self.set_integrator(integrator)
         self.adjust()
 
-    def calculate(self, position, velocity, dt, output):
+    def forces(self, position, velocity, output):
+        self.evaluations += 1
         result = self.motor.torque(velocity, output)
         result['torque_from_gravity'] = (-g * self.mass * math.cos(position)) * self.centre_of_mass
         torque = result['gearbox_torque'] + result['torque_from_gravity']
@@ -22,12 +26,16 @@ class ModelArm(Model):
         result['bearing_friction'] = -math.copysign(min(abs(torque), bearing_friction), velocity)
         result['torque'] = torque + result['bearing_friction']
         result['acceleration'] = result['torque'] * self.inertia
-        result['velocity'] = velocity + result['acceleration'] * dt
-        new_position = position + dt * (velocity + result['velocity'])/2 
+        return result
+
+    def calculate(self, position, velocity, dt, output):
+        result = self.forces(position, velocity, output)
+        acceleration = lambda position, velocity: self.forces(position, velocity, output)['acceleration']
+        (new_position, result['velocity']) = self.integrator(acceleration, position, velocity, result['acceleration'], dt)
         result['position'] = input_modulus(new_position, -math.pi, math.pi)
         result['position_deg'] = radians_to_degrees(result['position'] )
         result['velocity_deg'] = radians_to_degrees(result['velocity'])
-        result['acceleration_deg'] = radians_to_degrees(result['acceleration']),
+        result['acceleration_deg'] = radians_to_degrees(result['acceleration'])
         return result
 
     def ff(self, f, setpoint):
@@ -37,6 +45,10 @@ class ModelArm(Model):
         self.mass = value
         self.adjust()
 
+    def set_integrator(self, name):
+        self.integrator_name = name
+        self.integrator = get_integrator(name)
+
     def set_length(self, value):
         self.length = value
         self.adjust()
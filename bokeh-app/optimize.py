@@ -0,0 +1,149 @@
+import math
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+
+import numpy as np
+
+from process import configure
+from simulation import simulate
+from search import gains, grid, linspace
+
+# Tune the gains automatically, by minimizing a weighted cost of the
+# Analyze results over (f, p, i, d, izone), e.g.
+#
+#   config = dict(motor="VEX BAG", ratio=150, n_motors=1, mass=5, length=1, cof=0.05, efficiency=0.85, setpoint=0)
+#   best = optimize(config, start=dict(f=0.3, p=0.5, i=0.1, d=0.1, izone=20))
+#   best['gains'], best['cost']
+#
+# The search is an evolution strategy: each generation samples a population
+# around the mean from a Gaussian with a step size per gain, the mean moves
+# to a weighted average of the best, and the step sizes shrink to match how
+# spread out the best were (CMA-ES, but with a diagonal covariance).  Each
+# population is simulated in parallel.
+
+# The range of each gain, as on the sliders.
+bounds = dict(f=(0, 1), p=(0, 1), i=(0, 1), d=(0, 1), izone=(0, 90))
+
+default_weights = dict(overshoot=10, settling_time=1, steady_state_error=10)
+penalty = 100
+
+
+def cost(result, weights=default_weights):
+    """Lower is better.  Runs that don't settle cost penalty, and more the sooner they fail."""
+    if not result['settled']:
+        return penalty * (1 + 1 / (1 + result['final_time']))
+    return sum(weight * result[objective] for objective, weight in weights.items())
+
+
+def evaluate(config, candidates, initial_position=-math.pi/2, weights=default_weights):
+    """The cost of each candidate set of gains on the configured arm."""
+    return [cost(simulate(lambda process: configure(process, {**config, **candidate}), initial_position), weights)
+        for candidate in candidates]
+
+
+def to_gains(x):
+    return { gain: bounds[gain][0] + value * (bounds[gain][1] - bounds[gain][0]) for gain, value in zip(gains, x) }
+
+
+def from_gains(values):
+    return np.array([(values[gain] - bounds[gain][0]) / (bounds[gain][1] - bounds[gain][0]) for gain in gains])
+
+
+class Evaluator:
+    """Simulates populations across a pool of worker processes, or here if workers is 1."""
+    def __init__(self, config, initial_position, weights, workers=None):
+        self.config = config
+        self.initial_position = initial_position
+        self.weights = weights
+        self.workers = workers or cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        self.evaluations = 0
+
+    def __call__(self, candidates):
+        self.evaluations += len(candidates)
+        if self.pool is None:
+            return evaluate(self.config, candidates, self.initial_position, self.weights)
+        chunks = [candidates[k::self.workers] for k in range(self.workers)]
+        costs = list(self.pool.map(evaluate, itertools.repeat(self.config), chunks,
+            itertools.repeat(self.initial_position), itertools.repeat(self.weights)))
+        # Put the interleaved chunks back in order.
+        result = [None] * len(candidates)
+        for k, chunk_costs in enumerate(costs):
+            result[k::self.workers] = chunk_costs
+        return result
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def optimize(config, start=None, initial_position=-math.pi/2, weights=default_weights, population=12,
+        generations=10, step=0.25, tolerance=0.01, patience=4, seed=0, workers=None, progress=None):
+    """
+    Minimize cost over the gains, starting from start (default the middle
+    of each range).  Stops after generations, once every step size is below
+    tolerance (as a fraction of its range), or after patience generations
+    without improvement.  If given, progress(generation, best) is called
+    after each generation, and may raise to stop.
+
+    Returns dict(gains, cost, result, evaluations, generations, history).
+    """
+    rng = np.random.default_rng(seed)
+    n = len(gains)
+    mean = from_gains({**{gain: sum(bounds[gain]) / 2 for gain in gains}, **(start or {})})
+    sigma = np.full(n, step)
+    parents = population // 2
+    ranks = np.log(parents + 0.5) - np.log(np.arange(1, parents + 1))
+    ranks /= ranks.sum()
+
+    evaluator = Evaluator(config, initial_position, weights, workers)
+    try:
+        best = dict(x=mean, cost=evaluator([to_gains(mean)])[0])
+        history = [best['cost']]
+        stale = 0
+        generation = 0
+        for generation in range(1, generations + 1):
+            xs = np.clip(mean + sigma * rng.standard_normal((population, n)), 0, 1)
+            costs = np.array(evaluator([to_gains(x) for x in xs]))
+            order = np.argsort(costs, kind='stable')
+            elite = xs[order[:parents]]
+            # Step sizes from the spread of the best about the old mean, smoothed.
+            sigma = 0.5 * sigma + 0.5 * np.sqrt(ranks @ (elite - mean) ** 2)
+            mean = ranks @ elite
+            if costs[order[0]] < best['cost']:
+                best = dict(x=xs[order[0]], cost=float(costs[order[0]]))
+                stale = 0
+            else:
+                stale += 1
+            history.append(best['cost'])
+            if progress is not None:
+                progress(generation, dict(gains=to_gains(best['x']), cost=best['cost']))
+            if (sigma < tolerance).all() or stale >= patience:
+                break
+    finally:
+        evaluator.close()
+    values = to_gains(best['x'])
+    result = simulate(lambda process: configure(process, {**config, **values}), initial_position)
+    return dict(gains=values, cost=best['cost'], result=result, evaluations=evaluator.evaluations,
+        generations=generation, history=history)
+
+
+def grid_search(config, budget, initial_position=-math.pi/2, weights=default_weights, workers=None):
+    """The best of an even grid over the gains with at most budget points, for comparison."""
+    counts = dict.fromkeys(gains, 1)
+    grown = True
+    while grown:
+        grown = False
+        for gain in gains:
+            if math.prod(counts.values()) // counts[gain] * (counts[gain] + 1) <= budget:
+                counts[gain] += 1
+                grown = True
+    candidates = grid(**{ gain: linspace(*bounds[gain], counts[gain]) for gain in gains })
+    evaluator = Evaluator(config, initial_position, weights, workers)
+    try:
+        costs = evaluator(candidates)
+    finally:
+        evaluator.close()
+    k = int(np.argmin(costs))
+    return dict(gains=candidates[k], cost=costs[k], evaluations=evaluator.evaluations)
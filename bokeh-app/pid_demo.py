@@ -0,0 +1,204 @@
+from time import perf_counter
+started = perf_counter()
+
+import sys
+import json
+import argparse
+
+# Analysis without Bokeh, e.g. for tuning jobs.  From this directory:
+#
+#   python -m pid_demo analyze --config arm.json --grid p=0:1:11 --grid d=0,0.1,0.2
+#   python -m pid_demo analyze --config arm.json --input candidates.csv --workers 8
+#   python -m pid_demo sweep --config arm.json --ratio 50 --ratio 100 --workers 8
+#
+# Each configuration is the defaults (as the app starts), then --config, then
+# a row of --input or the --grid, using the names and units of the controls.
+# Results are written as JSON lines as they're ready, in input order; for
+# sweep, in the order they finish, then ranked if --rank.
+# Nothing but the simulation is imported, and that only once it's needed.
+
+
+def load(path):
+    """Control values from a JSON or YAML file."""
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def number(text):
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text # e.g. a motor name
+
+
+def read_rows(path):
+    """Rows of control values from CSV, a JSON list, or JSON lines."""
+    if path == '-':
+        text = sys.stdin.read()
+    else:
+        with open(path) as f:
+            text = f.read()
+    if path.endswith('.csv'):
+        import csv
+        return [{ key: number(value) for key, value in row.items() } for row in csv.DictReader(text.splitlines())]
+    text = text.strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def parse_grid(specs):
+    """Rows for every combination of name=start:stop:num or name=a,b,c."""
+    import itertools
+    ranges = {}
+    for spec in specs:
+        name, values = spec.split('=', 1)
+        if ':' in values:
+            start, stop, num = values.split(':')
+            start, stop, num = float(start), float(stop), int(num)
+            ranges[name] = [start + (stop - start) * k / (num - 1) for k in range(num)] if num > 1 else [start]
+        else:
+            ranges[name] = [number(value) for value in values.split(',')]
+    names = list(ranges.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*(ranges[name] for name in names))]
+
+
+def analyze_one(values, initial_position, early_stop, predict=False):
+    import math
+    from process import configure
+    from simulation import simulate
+    return simulate(lambda process: configure(process, values), math.radians(initial_position), early_stop=early_stop,
+        predict=predict)
+
+
+def analyze(args):
+    from process import defaults, control_callbacks
+    config = dict(defaults)
+    if args.config:
+        config.update(load(args.config))
+    if args.input:
+        rows = read_rows(args.input)
+    elif args.grid:
+        rows = parse_grid(args.grid)
+    else:
+        rows = [{}]
+    configs = [{**config, **row} for row in rows]
+    for values in configs:
+        unknown = set(values) - set(control_callbacks)
+        if unknown:
+            raise SystemExit(f"unknown controls: {', '.join(sorted(unknown))}")
+
+    cache = None
+    if args.cache:
+        import cache as result_cache
+        cache = result_cache.ResultCache(path=args.cache)
+
+    def key(values):
+        # The same keys as Analyze in the app uses, when they're the same runs.
+        import math
+        import cache as result_cache
+        options = {} if args.early_stop else dict(early_stop=False)
+        if args.predict:
+            options['predict'] = True
+        return result_cache.key(values, math.radians(args.initial_position), **options)
+
+    pending = []
+    for values in configs:
+        result = cache.get(key(values)) if cache is not None else None
+        pending.append((values, result))
+
+    def emit(row, result):
+        sys.stdout.write(json.dumps({**row, **result}) + "\n")
+        sys.stdout.flush()
+
+    todo = [values for values, result in pending if result is None]
+    if args.workers == 1 or len(todo) < 2:
+        results = (analyze_one(values, args.initial_position, args.early_stop, args.predict) for values in todo)
+        executor = None
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        import itertools
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+        results = executor.map(analyze_one, todo,
+            itertools.repeat(args.initial_position), itertools.repeat(args.early_stop),
+            itertools.repeat(args.predict))
+    try:
+        for (values, result), row in zip(pending, rows):
+            if result is None:
+                result = next(results)
+                if cache is not None:
+                    cache.put(key(values), result)
+            emit(row if not args.full else values, result)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if args.verbose:
+        print(f"{len(configs)} analyzed in {perf_counter() - started:.2f}s", file=sys.stderr)
+
+
+def sweep(args):
+    import hardware
+    from process import defaults
+    config = dict(defaults)
+    if args.config:
+        config.update(load(args.config))
+    results = None
+    if args.cache:
+        import cache as result_cache
+        results = result_cache.ResultCache(path=args.cache)
+    combinations = hardware.combinations(args.motor or None, args.ratio or hardware.default_ratios,
+        args.n_motors or hardware.default_n_motors)
+    done = []
+    for result in hardware.sweep(config, combinations, workers=args.workers, results=results):
+        done.append(result)
+        if not args.rank:
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+    if args.rank:
+        for result in hardware.rank(done):
+            sys.stdout.write(json.dumps(result) + "\n")
+    if args.verbose:
+        print(f"{len(done)} combinations in {perf_counter() - started:.2f}s", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pid_demo", description="Simulate the arm without the UI.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('analyze', help="simulate configurations until they settle, or don't")
+    command.add_argument('--config', help="JSON or YAML file of control values")
+    command.add_argument('--input', help="CSV, JSON list or JSON lines of control values, one configuration each, or - for stdin")
+    command.add_argument('--grid', action='append', default=[], metavar='NAME=START:STOP:NUM|NAME=A,B,...',
+        help="values of a control to try, in every combination with the other --grid controls")
+    command.add_argument('--initial-position', type=float, default=-90, help="degrees (default -90)")
+    command.add_argument('--no-early-stop', dest='early_stop', action='store_false')
+    command.add_argument('--predict', action='store_true',
+        help="also stop runs that look like they won't settle (a guess, which can be wrong)")
+    command.add_argument('--workers', type=int, default=None, help="processes to use (default one per CPU)")
+    command.add_argument('--cache', help="SQLite file to keep results in, shared with the app's ARM_RESULT_CACHE")
+    command.add_argument('--full', action='store_true', help="echo every control value, not just the row's")
+    command.add_argument('--verbose', '-v', action='store_true', help="report timings on stderr")
+    command.set_defaults(run=analyze)
+    command = commands.add_parser('sweep', help="find the best gains for each motor, ratio and number of motors")
+    command.add_argument('--config', help="JSON or YAML file of control values for the arm")
+    command.add_argument('--motor', action='append', default=[], help="a motor to try (default every one)")
+    command.add_argument('--ratio', action='append', type=number, default=[], help="a gear ratio to try")
+    command.add_argument('--n-motors', action='append', type=int, default=[], help="a number of motors to try")
+    command.add_argument('--rank', action='store_true', help="write the results best first, once all are done")
+    command.add_argument('--workers', type=int, default=None, help="processes to use (default one per CPU)")
+    command.add_argument('--cache', help="SQLite file to keep results in, shared with the app's ARM_RESULT_CACHE")
+    command.add_argument('--verbose', '-v', action='store_true', help="report timings on stderr")
+    command.set_defaults(run=sweep)
+    args = parser.parse_args(argv)
+    if args.verbose:
+        print(f"started in {perf_counter() - started:.3f}s", file=sys.stderr)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,23 @@
 import math 
 
-from math_util import clamp, radians_to_degrees
+from math_util import clamp, radians_to_degrees, degrees_to_radians
 from time import time
 from motor import Motor, Gearbox, Falcon500, Bearing
 from pid import PID
 from model import ModelArm
+from constants import g, max_lag, update_frequency
+import kernel
 
 class Process:
-    def __init__(self, f=0, now=None):
+    def __init__(self, f=0, now=None, physics_frequency=None):
         if now is None:
             now = time()
         self.last_time = now
         self.start = now
+        # For run(): the physics rate, physics steps taken, and steps owed.
+        self.physics_frequency = physics_frequency
+        self.physics_steps = 0
+        self.lag = 0
         motor = Falcon500()
         gearbox = Gearbox(motor, 20)
         bearing = Bearing(cof=0.05, radius=0.16)
@@ -21,6 +27,7 @@ class Process:
         self.pid = PID()
         self.pid.enable_continuous_input(-math.pi, math.pi)
         self.voltage = 12
+        self.trace = None # e.g. a recording.TraceWriter, given every step's result
         self.reset()
 
     def update(self, now=None):
@@ -28,10 +35,14 @@ class Process:
             now = time()
         dt = now - self.last_time
         self.last_time = now
+        return self._update(dt, now - self.start)
+
+    def _update(self, dt, ts, control_dt=None):
+        """One step of dt, then the PID, which has been holding its output for control_dt (default dt)."""
         result = self.model.calculate(position=self.position, velocity=self.velocity, dt=dt, output=self.output)
         self.position = result['position']
         self.velocity = result['velocity']
-        result.update(self.pid.calculate(measurement=self.position, dt=dt))
+        result.update(self.pid.calculate(measurement=self.position, dt=control_dt or dt))
         # voltage and self.output are clamped, other outputs are not
         result['f_output'] = self.model.ff(self.f, self.pid.setpoint)        
         result['output'] = result['output'] + result['f_output']
@@ -41,11 +52,87 @@ class Process:
         result['i_voltage'] = clamp(result['i_output'], -1, 1) * self.voltage
         result['d_voltage'] = clamp(result['d_output'], -1, 1) * self.voltage
         result['f_voltage'] = clamp(result['f_output'], -1, 1) * self.voltage
-        result['ts'] = now - self.start
+        result['ts'] = ts
         assert set(result.keys()) == set(self.columns), (sorted(result.keys()), sorted(self.columns))
+        if self.trace is not None:
+            self.trace.append(result)
+        return result
+
+    def run(self, now=None):
+        """
+        Catch up to now in fixed steps of 1/physics_frequency, whatever the
+        time since the last call.  The PID runs at update_frequency, as in
+        simulate(), its output held over the physics steps in between.
+        Returns the telemetry of the last control step, or None if none was
+        due.  The sim time (ts) counts physics steps, so it doesn't depend on
+        how promptly we're called.  If we fall more than max_lag seconds
+        behind, the excess is dropped rather than simulated.
+        """
+        if now is None:
+            now = time()
+        dt = 1.0 / self.physics_frequency
+        per_control = max(1, round(self.physics_frequency / update_frequency))
+        # Owed steps are counted as such, not as seconds, and a step owed to
+        # within rounding is taken, so that matching rates step evenly.
+        self.lag = min(self.lag + (now - self.last_time) * self.physics_frequency, max_lag * self.physics_frequency)
+        self.last_time = now
+        n = int(self.lag + 1e-6)
+        self.lag = max(0.0, self.lag - n)
+        result = None
+        while n > 0:
+            # Up to and including the next control step, if it's due.
+            k = min(n, per_control - self.physics_steps % per_control)
+            held = k if (self.physics_steps + k) % per_control else k - 1
+            if held:
+                self.advance(dt, held, control=False)
+            self.physics_steps += k
+            if held < k:
+                result = self._update(dt, self.physics_steps * dt, control_dt=per_control * dt)
+            n -= k
         return result
 
-    def reset(self, position=-math.pi/2.0):
+    def step(self, now=None):
+        """As update(), but without the telemetry, and much faster."""
+        if now is None:
+            now = time()
+        dt = now - self.last_time
+        self.last_time = now
+        self.advance(dt)
+
+    def advance(self, dt, n=1, control=True):
+        """
+        Advance n steps of dt without telemetry, through the fused kernel, or
+        if the arm has an integrator other than the kernel's (euler) through
+        the model, as update() does.  Without control the PID's output is
+        held, and the PID not run.
+        """
+        model = self.model
+        if model.integrator_name != 'euler':
+            for _ in range(n):
+                result = model.calculate(position=self.position, velocity=self.velocity, dt=dt, output=self.output)
+                self.position = result['position']
+                self.velocity = result['velocity']
+                if not control:
+                    continue
+                output = self.pid.calculate(measurement=self.position, dt=dt)['output'] + model.ff(self.f, self.pid.setpoint)
+                self.output = clamp(output, -1, 1)
+            return
+        gearbox = model.motor
+        pid = self.pid
+        stall_torque, free_speed = gearbox.motor.curves()
+        (self.position, self.velocity, self.output, pid.last_err, pid.err_acc) = kernel.steps(
+            n, dt, control, self.position, self.velocity, self.output, pid.last_err, pid.err_acc,
+            model.inertia, g * model.mass * model.centre_of_mass,
+            model.bearing.friction(model.mass) if model.bearing is not None else 0.0,
+            gearbox.motor.voltage, stall_torque, free_speed, gearbox.ratio, gearbox.n_motors, gearbox.efficiency,
+            pid.p, pid.i, pid.d, pid.izone, pid.setpoint, pid.error_bound, model.ff(self.f, pid.setpoint))
+
+    def reset(self, position=-math.pi/2.0, now=None):
+        if now is not None:
+            self.last_time = now
+            self.start = now
+            self.physics_steps = 0
+            self.lag = 0
         self.position = position
         self.velocity = 0
         self.pid.reset()
@@ -54,10 +141,45 @@ class Process:
     def set_f(self, value):
         self.f = value
 
+    def set_integrator(self, name):
+        self.model.set_integrator(name)
+
+    def set_trace(self, trace):
+        self.trace = trace
+
     
 
     @property
     def columns(self):
         return ['voltage', 'ts', 
             'f_voltage', 'f_output', 'p_voltage', 'i_voltage', 'd_voltage',
-            ] + self.pid.columns + self.model.columns
\ No newline at end of file
+            ] + self.pid.columns + self.model.columns
+
+
+control_callbacks = dict(
+    # P, I, and D are all per-radian so can be passed on directly.
+    p=lambda process, value: process.pid.set_p(value),
+    i=lambda process, value: process.pid.set_i(value),
+    d=lambda process, value: process.pid.set_d(value),
+    f=lambda process, value: process.set_f(value),
+    izone=lambda process, value: process.pid.set_izone(degrees_to_radians(value)),
+    setpoint=lambda process, value: process.pid.set_setpoint(degrees_to_radians(value)),
+    ratio=lambda process, value: process.model.motor.set_ratio(value),
+    mass=lambda process, value: process.model.set_mass(value),
+    length=lambda process, value: process.model.set_length(value),
+    cof=lambda process, value: process.model.bearing.set_cof(value),
+    efficiency=lambda process, value: process.model.motor.set_efficiency(value),
+    motor=lambda process, value: process.model.motor.set_motor(Motor.get_by_name(value)),
+    n_motors=lambda process, value: process.model.motor.set_n_motors(value),
+)
+
+
+# The controls' values when the app starts.
+defaults = dict(p=0., i=0., d=0., f=0., izone=20., setpoint=0., ratio=1, mass=1., length=1., cof=0.05, efficiency=0.85,
+    motor=list(Motor.motors.keys())[0], n_motors=1)
+
+
+def configure(process, values):
+    """Apply control values (as shown in the UI) to process."""
+    for key, value in values.items():
+        control_callbacks[key](process, value)
@@ -0,0 +1,139 @@
+import os
+import queue
+import threading
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Recording every step of a run to a file, for analysis offline, e.g.
+#
+#   with TraceWriter("run.arrow", Process(now=0).columns) as trace:
+#       simulate(process_init, trace=trace)
+#   df = pandas.read_feather("run.arrow")
+#
+# The format follows the extension: .arrow (or .feather) for Arrow IPC,
+# .parquet for Parquet, .csv for CSV.  Arrow and Parquet need pyarrow;
+# without it, other extensions fall back to CSV.
+
+formats = { '.arrow': 'arrow', '.feather': 'arrow', '.parquet': 'parquet', '.csv': 'csv' }
+
+
+class TraceWriter:
+    """
+    Collects rows into chunks of chunk_size samples, one numpy array per
+    column, and hands each full chunk to a background thread to write.  At
+    most queue_size chunks wait to be written, so memory stays bounded
+    however long the run; beyond that append() blocks or, if not block
+    (e.g. on the server's event loop), drops the chunk and counts it in
+    dropped.
+
+    Each row is the result of one Process step.  extra is an optional
+    mapping, e.g. the current control values, whose values are recorded
+    alongside every row.
+    """
+    def __init__(self, path, columns, extra=None, chunk_size=4096, queue_size=8, block=True):
+        self.extra = extra if extra is not None else {}
+        # (Process.columns names motor_torque twice.)
+        self.columns = list(dict.fromkeys(list(columns) + list(self.extra.keys())))
+        self.format = formats.get(os.path.splitext(path)[1].lower(), 'csv')
+        if pa is None and self.format != 'csv':
+            path = os.path.splitext(path)[0] + '.csv'
+            self.format = 'csv'
+        self.path = path
+        self.chunk_size = chunk_size
+        self.chunk = self._new_chunk()
+        self.index = 0
+        self.count = 0 # rows ever appended
+        self.block = block
+        self.dropped = 0 # chunks
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def _new_chunk(self):
+        return { column: np.empty(self.chunk_size) for column in self.columns }
+
+    def append(self, row):
+        if self.error is not None:
+            raise self.error
+        index = self.index
+        chunk = self.chunk
+        for key, value in row.items():
+            chunk[key][index] = value
+        for key, value in self.extra.items():
+            chunk[key][index] = value
+        self.index += 1
+        self.count += 1
+        if self.index == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Hand any rows collected so far to the writer."""
+        if self.index:
+            chunk = { column: array[:self.index] for column, array in self.chunk.items() }
+            try:
+                self.queue.put(chunk, block=self.block)
+            except queue.Full:
+                self.dropped += 1
+            self.chunk = self._new_chunk()
+            self.index = 0
+
+    def close(self):
+        """Write everything appended, and close the file."""
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write(self):
+        writer = None
+        try:
+            while True:
+                chunk = self.queue.get()
+                if chunk is None:
+                    break
+                if writer is None:
+                    writer = self._open()
+                self._write_chunk(writer, chunk)
+        except Exception as e:
+            self.error = e
+            # Keep draining so append() doesn't block forever.
+            while self.queue.get() is not None:
+                pass
+        finally:
+            if writer is None and self.error is None:
+                writer = self._open() # an empty trace still gets its header
+            if writer is not None:
+                writer.close()
+
+    def _open(self):
+        if self.format == 'arrow':
+            schema = pa.schema([(column, pa.float64()) for column in self.columns])
+            return pa.ipc.new_file(self.path, schema)
+        if self.format == 'parquet':
+            schema = pa.schema([(column, pa.float64()) for column in self.columns])
+            return pq.ParquetWriter(self.path, schema)
+        f = open(self.path, 'w')
+        f.write(",".join(self.columns) + "\n")
+        return f
+
+    def _write_chunk(self, writer, chunk):
+        if self.format == 'arrow':
+            writer.write_batch(pa.record_batch([chunk[column] for column in self.columns], names=self.columns))
+        elif self.format == 'parquet':
+            writer.write_table(pa.table({ column: chunk[column] for column in self.columns }))
+        else:
+            np.savetxt(writer, np.column_stack([chunk[column] for column in self.columns]), delimiter=",", fmt="%.17g")
@@ -0,0 +1,140 @@
+import io
+import mmap
+
+import numpy as np
+
+from constants import update_frequency, frame_rate
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Playing back a trace recorded by recording.TraceWriter, without a Process.
+# Traces are memory-mapped and read a window at a time, so they can be much
+# bigger than RAM.  Arrow IPC traces (.arrow, .feather) need pyarrow; CSV
+# traces need nothing more than numpy.
+
+
+class ArrowTrace:
+    """An Arrow IPC trace, its record batches memory-mapped and read without copying."""
+    def __init__(self, path):
+        self.reader = pa.ipc.open_file(pa.memory_map(path))
+        self.columns = self.reader.schema.names
+        self.batches = [self.reader.get_batch(k) for k in range(self.reader.num_record_batches)]
+        self.starts = np.cumsum([0] + [batch.num_rows for batch in self.batches])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def rows(self, start, stop, step=1):
+        """Every step'th row from start to stop, as a dict of arrays."""
+        indices = np.arange(start, stop, step)
+        result = { column: np.empty(len(indices)) for column in self.columns }
+        first = np.searchsorted(self.starts, start, side='right') - 1
+        done = 0
+        for b in range(max(first, 0), len(self.batches)):
+            if done == len(indices):
+                break
+            batch = self.batches[b]
+            end = np.searchsorted(indices, self.starts[b + 1])
+            local = indices[done:end] - self.starts[b]
+            for k, column in enumerate(self.columns):
+                result[column][done:end] = batch.column(k).to_numpy()[local]
+            done = end
+        return result
+
+
+class CsvTrace:
+    """
+    A CSV trace, memory-mapped.  Opening it scans once for line starts,
+    keeping an index of 8 bytes a row; rows are parsed only when read.
+    """
+    def __init__(self, path, scan_size=1 << 24):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = self.map.find(b"\n")
+        self.columns = self.map[:header_end].decode().split(",")
+        starts = [np.array([header_end + 1])]
+        for offset in range(header_end + 1, len(self.map), scan_size):
+            chunk = np.frombuffer(self.map, dtype=np.uint8, count=min(scan_size, len(self.map) - offset), offset=offset)
+            starts.append(offset + np.flatnonzero(chunk == ord("\n")) + 1)
+        self.starts = np.concatenate(starts)
+        # The last line start is the end of the file, not a row.
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def rows(self, start, stop, step=1):
+        """Every step'th row from start to stop, as a dict of arrays."""
+        starts = self.starts[start:stop:step]
+        text = b"".join(self.map[a:b] for a, b in zip(starts, self.starts[start + 1:stop + 1:step]))
+        data = np.loadtxt(io.BytesIO(text), delimiter=",", ndmin=2).reshape(-1, len(self.columns))
+        return { column: data[:, k] for k, column in enumerate(self.columns) }
+
+
+def open_trace(path):
+    if path.lower().endswith(('.arrow', '.feather')):
+        if pa is None:
+            raise ValueError("pyarrow is needed to replay Arrow traces")
+        return ArrowTrace(path)
+    return CsvTrace(path)
+
+
+class Replay:
+    """
+    Plays a trace back in sim time at speed times real time.  Each frame()
+    returns the rows since the last, decimated to at most the rows the live
+    dashboard would get per frame.  Columns the trace lacks (e.g. setpoint,
+    in traces of simulate()) are filled with zeros.
+    """
+    def __init__(self, trace, columns, speed=1):
+        self.trace = trace
+        self.columns = columns
+        self.speed = speed
+        self.playing = True
+        self.index = 0
+        self.budget = max(1, update_frequency // frame_rate)
+        self.duration = self.time(len(trace) - 1) if len(trace) else 0
+
+    def time(self, index):
+        return float(self.trace.rows(index, index + 1)['ts'][0])
+
+    def find(self, time):
+        """The index of the first row at or after time."""
+        low, high = 0, len(self.trace)
+        while low < high:
+            middle = (low + high) // 2
+            if self.time(middle) < time:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _rows(self, start, stop, budget):
+        step = max(1, -(-(stop - start) // budget))
+        rows = self.trace.rows(start, stop, step) if stop > start else { column: np.zeros(0) for column in self.trace.columns }
+        n = len(rows['ts'])
+        return { column: rows[column] if column in rows else np.zeros(n) for column in self.columns }
+
+    def frame(self):
+        """The rows to stream for the next frame, or None if none are due."""
+        if not self.playing or self.index >= len(self.trace):
+            return None
+        now = self.time(self.index)
+        stop = self.find(now + self.speed / frame_rate)
+        stop = max(stop, self.index + 1)
+        rows = self._rows(self.index, stop, self.budget)
+        self.index = stop
+        return rows
+
+    def seek(self, time, history):
+        """Move to time, returning the rows of the history seconds before it, decimated to fit the dashboard."""
+        self.index = self.find(time)
+        start = self.find(time - history)
+        return self._rows(start, self.index, int(update_frequency * history))
+
+    @property
+    def position(self):
+        """The sim time reached."""
+        return self.time(min(self.index, len(self.trace) - 1)) if len(self.trace) else 0
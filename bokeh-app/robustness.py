@@ -0,0 +1,83 @@
+import math
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+
+import numpy as np
+
+from process import Process, configure
+from batch import ArmBatch, simulate_rows
+from search import objectives
+
+# How well does one set of gains cope with the arm starting anywhere, and
+# with the arm not quite being what we think it is?  e.g.
+#
+#   config = dict(motor="VEX BAG", ratio=150, n_motors=1, mass=5, length=1, cof=0.05, efficiency=0.85,
+#       setpoint=0, f=0.3, p=0.5, i=0.1, d=0.1, izone=20)
+#   report = robustness(config, runs=200)
+#   report['settling_time']['p95']
+
+# Relative standard deviation of each perturbed quantity.  Friction is the
+# least well known.
+default_spread = dict(mass=0.1, length=0.05, cof=0.5)
+
+
+def draw(config, rng, n, spread=default_spread):
+    """n perturbed copies of config, each with a random initial position."""
+    samples = []
+    for _ in range(n):
+        values = dict(config)
+        for key, sd in spread.items():
+            values[key] = config[key] * max(0.01, 1 + sd * rng.standard_normal())
+        values['cof'] = min(1, values['cof'])
+        samples.append((values, rng.uniform(-math.pi, math.pi)))
+    return samples
+
+
+def evaluate(config, seed, n, spread=default_spread):
+    """Simulate n samples drawn with the random stream seeded by seed, as one batch."""
+    samples = draw(config, np.random.default_rng(seed), n, spread)
+    process = Process(now=0)
+    rows = []
+    for values, initial_position in samples:
+        configure(process, values)
+        process.reset(initial_position, now=0)
+        rows.append(ArmBatch.row(process))
+    results = simulate_rows(rows, [initial_position for values, initial_position in samples])
+    return [{**{key: values[key] for key in spread}, **result} for (values, _), result in zip(samples, results)]
+
+
+def summarize(results):
+    """p50, p95 and max of each objective over the settled runs, and the fraction that didn't settle."""
+    settled = [result for result in results if result['settled']]
+    summary = dict(runs=len(results), unsettled=1 - len(settled) / len(results))
+    for objective in objectives:
+        values = np.array([result[objective] for result in settled])
+        if len(values):
+            summary[objective] = dict(p50=float(np.percentile(values, 50)),
+                p95=float(np.percentile(values, 95)), max=float(values.max()))
+        else:
+            summary[objective] = None
+    return summary
+
+
+def robustness(config, runs=100, spread=default_spread, seed=0, workers=None, chunk_size=16):
+    """
+    Simulate config from runs random initial positions, perturbing mass,
+    length and cof, and summarize the results.
+
+    Runs are split into chunks of chunk_size, each simulated as a batch with
+    its own random stream spawned from seed, across a pool of worker
+    processes.  The results depend on seed and chunk_size, but not on workers.
+    """
+    sizes = [min(chunk_size, runs - k) for k in range(0, runs, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = min(workers or cpu_count() or 1, len(sizes))
+    if workers == 1:
+        results = [evaluate(config, s, n, spread) for s, n in zip(seeds, sizes)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(evaluate,
+                itertools.repeat(config), seeds, sizes, itertools.repeat(spread)))
+    results = list(itertools.chain.from_iterable(results))
+    return dict(summarize(results), results=results)
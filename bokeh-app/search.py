@@ -0,0 +1,82 @@
+import math
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+
+from process import Process, configure
+from batch import ArmBatch, simulate_rows
+from constants import window
+
+# Search a grid of PID gains for one arm configuration.
+#
+# The arm configuration and the gains use the same names and units as the
+# controls in the UI (see control_callbacks), e.g.
+#
+#   config = dict(motor="VEX BAG", ratio=150, n_motors=1, mass=5, length=1, cof=0.05, efficiency=0.85)
+#   result = search(config, f=[0.3], p=linspace(0, 1, 21), i=[0, 0.1], d=linspace(0, 0.5, 11), izone=[20])
+#   result['front']  # the settled results nobody beats on every objective
+
+gains = ['f', 'p', 'i', 'd', 'izone']
+objectives = ['overshoot', 'settling_time', 'steady_state_error']
+
+
+def linspace(start, stop, num):
+    if num == 1:
+        return [start]
+    return [start + (stop - start) * k / (num - 1) for k in range(num)]
+
+
+def grid(**ranges):
+    """Every combination of the given values, as a list of dicts."""
+    keys = list(ranges.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*(ranges[key] for key in keys))]
+
+
+def evaluate(config, candidates, initial_position=-math.pi/2, deadline=window * 100):
+    """Simulate each candidate set of gains on the configured arm, as one batch, until deadline at most."""
+    process = Process(now=0)
+    rows = []
+    for candidate in candidates:
+        configure(process, {**config, **candidate})
+        process.reset(initial_position, now=0)
+        rows.append(ArmBatch.row(process))
+    results = simulate_rows(rows, [initial_position] * len(rows), deadline)
+    return [{**candidate, **result} for candidate, result in zip(candidates, results)]
+
+
+def dominates(a, b):
+    return all(a[x] <= b[x] for x in objectives) and any(a[x] < b[x] for x in objectives)
+
+
+def pareto_front(results):
+    """The settled results not dominated by any other, ordered by objectives."""
+    front = []
+    settled = sorted((x for x in results if x['settled']), key=lambda x: [x[o] for o in objectives])
+    for result in settled:
+        # Nothing later in this order can dominate anything earlier.
+        if not any(dominates(other, result) for other in front):
+            front.append(result)
+    return front
+
+
+def search(config, initial_position=-math.pi/2, workers=None, chunk_size=None, **ranges):
+    """
+    Simulate every combination of gains in ranges and return the Pareto front.
+
+    Candidates are split into chunks which are simulated as batches across a
+    pool of worker processes.  Gains not given in ranges are left at zero.
+    """
+    assert set(ranges.keys()) <= set(gains), ranges.keys()
+    candidates = grid(**{**{gain: [0] for gain in gains}, **ranges})
+    workers = workers or cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, math.ceil(len(candidates) / (workers * 4)))
+    chunks = [candidates[k:k + chunk_size] for k in range(0, len(candidates), chunk_size)]
+    if workers == 1:
+        results = [evaluate(config, chunk, initial_position) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(evaluate,
+                itertools.repeat(config), chunks, itertools.repeat(initial_position)))
+    results = list(itertools.chain.from_iterable(results))
+    return dict(results=results, front=pareto_front(results))
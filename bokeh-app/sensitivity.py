@@ -0,0 +1,107 @@
+import math
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+
+import numpy as np
+
+from process import Process, configure, control_callbacks
+from batch import ArmBatch, simulate_rows
+
+# How fragile is a tuning?  The sensitivity of each objective to each
+# parameter around one configuration, e.g.
+#
+#   config = dict(motor="VEX BAG", ratio=150, n_motors=1, mass=5, length=1, cof=0.05, efficiency=0.85,
+#       setpoint=0, f=0.3, p=0.5, i=0.1, d=0.1, izone=20)
+#   report = sensitivity(config, parameters=['p', 'd', 'mass', 'ratio'])
+#   report['jacobian']['settling_time']['mass']  # seconds per kg
+#
+# Each parameter is nudged up and down by a central difference, from the same
+# random initial positions as the unperturbed configuration: with common random
+# numbers each pair of runs differs only by the nudge, so the difference isn't
+# swamped by where the arm happened to start.  Every run, perturbed or not, is
+# simulated in one batch (split across worker processes), which gives the same
+# results as simulate() on each.
+
+default_parameters = ['p', 'd', 'mass', 'ratio']
+default_objectives = ['overshoot', 'settling_time']
+
+# The nudge, as a fraction of a parameter's value, or of its scale if larger.
+# Settling time only changes a step at a time, so too small a nudge sees none.
+default_step = 0.05
+scale = dict(f=1, p=1, i=1, d=1, izone=90, setpoint=360, ratio=1, mass=1, length=1, cof=1, efficiency=1, n_motors=1)
+
+
+def perturbations(config, parameters, step=default_step):
+    """The central difference pairs: (parameter, h, config + h, config - h) for each parameter."""
+    pairs = []
+    for parameter in parameters:
+        if parameter not in control_callbacks or isinstance(config[parameter], str):
+            raise ValueError(f"{parameter} is not a numeric control")
+        h = step * max(abs(config[parameter]), scale[parameter])
+        pairs.append((parameter, h, {**config, parameter: config[parameter] + h}, {**config, parameter: config[parameter] - h}))
+    return pairs
+
+
+def evaluate(configs, starts):
+    """Simulate each config from each of its initial positions, as one batch, grouped by config."""
+    process = Process(now=0)
+    rows = []
+    for values, initial_positions in zip(configs, starts):
+        configure(process, values)
+        for initial_position in initial_positions:
+            process.reset(initial_position, now=0)
+            rows.append(ArmBatch.row(process))
+    results = iter(simulate_rows(rows, list(itertools.chain.from_iterable(starts))))
+    return [list(itertools.islice(results, len(initial_positions))) for initial_positions in starts]
+
+
+def differences(plus, minus, h, objective):
+    """Per initial position, the central difference of objective where both runs settled."""
+    return np.array([(a[objective] - b[objective]) / (2 * h) for a, b in zip(plus, minus) if a['settled'] and b['settled']])
+
+
+def sensitivity(config, parameters=default_parameters, objectives=default_objectives, positions=16,
+        step=default_step, seed=0, common=True, workers=None):
+    """
+    Estimate d(objective)/d(parameter) around config by central differences,
+    averaged over positions random initial positions.  With common (the
+    default) every configuration starts from the same positions; without,
+    each gets its own, for comparison.
+
+    Returns dict(jacobian, stderr, pairs, base): the mean and standard error
+    of each derivative, as {objective: {parameter: value}}, the number of
+    pairs in which both runs settled, and the unperturbed results.  Where no
+    pair settled the derivative is nan.
+    """
+    rng = np.random.default_rng(seed)
+    pairs = perturbations(config, parameters, step)
+    configs = [config] + [values for _, _, plus, minus in pairs for values in (plus, minus)]
+    if common:
+        starts = [rng.uniform(-math.pi, math.pi, positions).tolist()] * len(configs)
+    else:
+        starts = [rng.uniform(-math.pi, math.pi, positions).tolist() for _ in configs]
+
+    workers = min(workers or cpu_count() or 1, len(configs))
+    if workers == 1:
+        results = evaluate(configs, starts)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(evaluate, [configs[k::workers] for k in range(workers)],
+                [starts[k::workers] for k in range(workers)]))
+        # Put the interleaved chunks back in order.
+        results = [None] * len(configs)
+        for k, chunk in enumerate(chunks):
+            results[k::workers] = chunk
+
+    base, results = results[0], results[1:]
+    jacobian = { objective: {} for objective in objectives }
+    stderr = { objective: {} for objective in objectives }
+    counts = { objective: {} for objective in objectives }
+    for (parameter, h, _, _), plus, minus in zip(pairs, results[0::2], results[1::2]):
+        for objective in objectives:
+            d = differences(plus, minus, h, objective)
+            counts[objective][parameter] = len(d)
+            jacobian[objective][parameter] = float(d.mean()) if len(d) else math.nan
+            stderr[objective][parameter] = float(d.std(ddof=1) / math.sqrt(len(d))) if len(d) > 1 else math.nan
+    return dict(jacobian=jacobian, stderr=stderr, pairs=counts, base=base)
@@ -0,0 +1,96 @@
+import os
+import logging
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import update_frequency, idle_timeout
+from cache import ResultCache
+from stabilitymap import SharedMaps
+
+# Bokeh runs main.py afresh for every browser session, so anything to be
+# shared between sessions lives here instead.
+
+log = logging.getLogger(__name__)
+
+# Analysis runs here, off the Bokeh event loop.
+executor = ThreadPoolExecutor(max_workers=4)
+
+# Analysis results, shared between sessions, and between server processes if
+# ARM_RESULT_CACHE names a SQLite file.
+results = ResultCache(path=os.environ.get('ARM_RESULT_CACHE'))
+
+# Stability maps, each made once for however many sessions are showing it.
+maps = SharedMaps(executor, results)
+
+
+class Session:
+    """The live simulation belonging to one browser session."""
+    def __init__(self, process, buffer, control_values):
+        self.process = process
+        self.buffer = buffer
+        self.control_values = control_values
+        self.suspended = False
+        self.last_active = time()
+
+    def touch(self):
+        """Note some user activity, resuming the simulation if it was suspended."""
+        self.last_active = time()
+        if self.suspended:
+            # Don't integrate over the time we were asleep.
+            self.process.last_time = self.last_active
+            self.suspended = False
+
+    def tick(self, now):
+        result = self.process.run(now=now)
+        if result is not None:
+            self.buffer.append(result, self.control_values)
+
+
+class Scheduler:
+    """
+    Steps every session's Process from one periodic callback on the server's
+    event loop, rather than one callback per session.  Sessions left alone
+    for idle_timeout seconds are suspended until touched.  A session whose
+    step raises doesn't stop the others: its trace, if any, is detached (a
+    failing disk being the likeliest cause), or else it's suspended.
+    """
+    def __init__(self, period=1.0 / update_frequency, idle_timeout=idle_timeout):
+        self.period = period
+        self.idle_timeout = idle_timeout
+        self.sessions = []
+        self.callback = None
+
+    def add(self, session):
+        self.sessions.append(session)
+        if self.callback is None:
+            from tornado.ioloop import PeriodicCallback
+            # Looked up each time, so diagnostics can wrap tick.
+            self.callback = PeriodicCallback(lambda: self.tick(), self.period * 1000)
+            self.callback.start()
+
+    def remove(self, session):
+        self.sessions.remove(session)
+
+    def tick(self):
+        now = time()
+        for session in self.sessions:
+            if session.suspended:
+                continue
+            if now - session.last_active > self.idle_timeout:
+                session.suspended = True
+                continue
+            try:
+                session.tick(now)
+            except Exception:
+                log.exception("Session step failed")
+                if session.process.trace is not None:
+                    session.process.set_trace(None)
+                else:
+                    session.suspended = True
+
+    @property
+    def active(self):
+        return sum(not session.suspended for session in self.sessions)
+
+
+scheduler = Scheduler()
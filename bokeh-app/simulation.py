@@ -1,12 +1,17 @@
 import random
 import math
 import itertools
-from statistics import mean
+from collections import deque
+from fractions import Fraction
 
 from process import Process
 from constants import update_frequency, window
 from math_util import radians_to_degrees
 
+class Cancelled(Exception):
+    """Raised by a progress callback to abandon a simulation."""
+
+
 def is_settled(errors, thumb, steady_state_interval):
     max_error = min_error = errors[-1]
     for j, error in reversed(list(itertools.islice(enumerate(errors), thumb, len(errors)-1))):
@@ -19,50 +24,215 @@ def is_settled(errors, thumb, steady_state_interval):
     return (True, thumb)
 
 
-def simulate(process_init, initial_position=None):
+# The mean is kept exactly, as integer multiples of the smallest float, so
+# that it agrees with statistics.mean to the last bit.
+_scale = 2 ** 1074
+
+def _exact(value):
+    numerator, denominator = value.as_integer_ratio()
+    return numerator * (_scale // denominator)
+
+
+class SettlingDetector:
+    """
+    Streaming equivalent of simulate()'s use of is_settled().
+
+    Feed it each error in turn with update(), which returns True once the
+    arm has settled.  Each update is amortised O(1), and it only remembers
+    the errors since the arm last left the steady state interval.
+    """
+    def __init__(self, initial_error, scan_window):
+        self.initial_error = initial_error
+        self.steady_state_interval = abs(initial_error) * 0.02 * 2 # 2% either way
+        self.scan_window = scan_window
+        self.overshoot = 0
+        self.overshoot_index = None
+        self.i = 0
+        self.thumb = 0 # as of the last settling check
+        self.start = 0 # earliest index from which all errors fit in the interval
+        self.highs = deque([(0, initial_error)]) # decreasing maxima since start
+        self.lows = deque([(0, initial_error)]) # increasing minima since start
+        self.errors = deque([_exact(initial_error)]) # errors since start
+        self.total = self.errors[0]
+
+    def update(self, error):
+        self.i += 1
+        i = self.i
+        while self.highs and self.highs[-1][1] <= error:
+            self.highs.pop()
+        self.highs.append((i, error))
+        while self.lows and self.lows[-1][1] >= error:
+            self.lows.pop()
+        self.lows.append((i, error))
+        exact = _exact(error)
+        self.errors.append(exact)
+        self.total += exact
+        while self.highs[0][1] - self.lows[0][1] > self.steady_state_interval:
+            # Any window holding both extremes is too wide, so start after the older.
+            if self.highs[0][0] < self.lows[0][0]:
+                start = self.highs.popleft()[0] + 1
+            else:
+                start = self.lows.popleft()[0] + 1
+            for _ in range(start - self.start):
+                self.total -= self.errors.popleft()
+            self.start = start
+
+        if self.initial_error > 0:
+            error = -error
+        if error > self.overshoot:
+            self.overshoot = error
+            self.overshoot_index = i
+            self.scan_window = max(self.overshoot_index, self.scan_window)
+        if i - self.thumb > self.scan_window: # check for settling
+            settled = self.start == self.thumb
+            self.thumb = self.start
+            return settled
+        return False
+
+    @property
+    def steady_state_error(self):
+        # Mean of errors[thumb:-1], as in is_settled()
+        count = len(self.errors) - 1
+        return abs(float(Fraction(self.total - self.errors[-1], _scale * count)) / self.initial_error)
+
+
+class EarlyStop:
+    """
+    Spots oscillating runs whose outcome is already clear.
+
+    Feed it each error in turn with update().  Once the last few periods are
+    regular, it projects the envelope forward, and returns a reason to stop:
+    'limit_cycle' if the oscillation is holding steady, 'diverging' if it is
+    growing, or 'too_slow' if it is decaying but won't settle by the deadline.
+    """
+    def __init__(self, steady_state_interval, deadline, periods=4, tolerance=0.2):
+        self.steady_state_interval = steady_state_interval
+        self.deadline = deadline
+        self.tolerance = tolerance
+        self.periods = periods
+        self.extrema = deque(maxlen=2 * periods + 1) # (index, error)
+        self.previous = None
+        self.rising = None
+
+    def update(self, i, error, time):
+        if self.previous is not None and error != self.previous:
+            rising = error > self.previous
+            if self.rising is not None and rising != self.rising:
+                self.extrema.append((i - 1, self.previous))
+                if len(self.extrema) == self.extrema.maxlen:
+                    self.rising = rising
+                    self.previous = error
+                    return self.verdict(time)
+            self.rising = rising
+        self.previous = error
+        return None
+
+    def verdict(self, time):
+        indices = [index for index, _ in self.extrema]
+        halves = [b - a for a, b in zip(indices, indices[1:])]
+        half = sum(halves) / len(halves)
+        if any(abs(x - half) > self.tolerance * half for x in halves):
+            return None # not regular enough to extrapolate
+        values = [value for _, value in self.extrema]
+        amplitudes = [abs(b - a) for a, b in zip(values, values[1:])]
+        if amplitudes[-1] <= self.steady_state_interval:
+            return None # about to settle
+        ratio = (amplitudes[-1] / amplitudes[0]) ** (2 / (len(amplitudes) - 1)) # per period
+        if all(b > a for a, b in zip(amplitudes, amplitudes[1:])):
+            return 'diverging'
+        if ratio >= 1 - self.tolerance / 100:
+            return 'limit_cycle'
+        periods = math.log(self.steady_state_interval / amplitudes[-1]) / math.log(ratio)
+        if time + periods * 2 * half / update_frequency > self.deadline:
+            return 'too_slow'
+        return None
+
+
+def simulate(process_init, initial_position=None, progress=None, integrator=None, early_stop=True, trace=None,
+        predict=False):
+    """
+    Simulate the arm from initial_position until it settles or fails to.
+
+    If given, progress(time, error) is called once per simulated second.  It
+    may raise Cancelled, which propagates to the caller.  integrator names one
+    of integrators.integrators to use instead of the arm's own.  If given,
+    trace (e.g. a recording.TraceWriter) is given the result of every step
+    actually simulated.
+
+    With early_stop, once the arm comes exactly to rest the rest of the run
+    is fast-forwarded, with the same result, and once it can no longer
+    settle before the deadline it stops there ('out_of_time'), with the same
+    verdict but an earlier final_time.  With predict as well, runs
+    caught by EarlyStop are reported as not settled; that's a guess, and
+    some oscillations it calls limit cycles do settle later, so it's off
+    unless asked for.  Results have 'detector' (None if the run went to its
+    end) and 'steps_saved' entries.
+    """
     process = Process(now=0)
     process_init(process)
+    if integrator is not None:
+        process.model.set_integrator(integrator)
     if initial_position is None:
         initial_position = random.uniform(-math.pi, math.pi)
     process.reset(initial_position)
+    process.set_trace(trace)
     initial_error = process.pid._calculate_difference(process.pid.setpoint - initial_position)
-    overshoot = 0
-    overshoot_index = None
     dt = 1.0 / update_frequency
-    scan_window = window * update_frequency * 2
+    deadline = window * 100
     times = itertools.count(start=dt, step=dt)
-    thumb = 0
-    steady_state_interval = abs(initial_error) * 0.02 * 2 # 2% either way
-    errors = [ initial_error ]
+    detector = SettlingDetector(initial_error, scan_window=window * update_frequency * 2)
+    early = EarlyStop(detector.steady_state_interval, deadline) if early_stop and predict else None
+    state = None
+
+    def report(time, settled, stopped_by=None, steps_saved=0):
+        result = dict(settled=settled)
+        if settled:
+            result.update(
+                steady_state_error=detector.steady_state_error,
+                overshoot=abs(detector.overshoot / initial_error),
+                settling_time=detector.thumb * dt,
+            )
+        result.update(
+            initial_position=initial_position,
+            initial_position_deg=radians_to_degrees(initial_position),
+            final_time=time,
+            detector=stopped_by,
+            steps_saved=steps_saved,
+        )
+        return result
+
     for i, time in enumerate(times, start=1):
         result = process.update(now=time)
         position = result['position']
         error = process.pid._calculate_difference(process.pid.setpoint - position)
         #print(dict(i=i, time=time, position=position, error=error))
-        if abs(error) > abs(initial_error) or time > window * 100 or initial_error == 0:
-            return dict(
-                settled=False,
-                initial_position=initial_position,
-                initial_position_deg=radians_to_degrees(initial_position),
-                final_time=time,
-            )        
-        assert i == len(errors)
-        errors.append(error)
-        if initial_error > 0:
-            error = -error
-        if error > overshoot:
-            overshoot = error
-            overshoot_index = i
-            scan_window = max(overshoot_index, scan_window)
-        if i - thumb > scan_window: # check for settling
-            (settled, thumb) = is_settled(errors, thumb, steady_state_interval)
-            if settled:
-                return dict(
-                    settled=True,
-                    steady_state_error=abs(mean(errors[thumb:-1]) / initial_error),
-                    overshoot=abs(overshoot / initial_error),
-                    settling_time=thumb * dt,
-                    initial_position=initial_position,
-                    initial_position_deg=radians_to_degrees(initial_position),
-                    final_time=time,
-                )
\ No newline at end of file
+        if progress is not None and i % update_frequency == 0:
+            progress(time, error)
+        if abs(error) > abs(initial_error) or time > deadline or initial_error == 0:
+            return report(time, settled=False)
+        if detector.update(error):
+            return report(time, settled=True)
+        if not early_stop:
+            continue
+
+        # Settling takes more than scan_window steps in the interval, from
+        # detector.start at the earliest, and scan_window only grows.  (The
+        # margin of a step covers the rounding of time.)
+        if (detector.start + detector.scan_window + 1) * dt > deadline + dt:
+            return report(time, settled=False, stopped_by='out_of_time', steps_saved=int((deadline - time) / dt))
+
+        # If a step changed nothing, nor will any later one.  (dt only
+        # enters through velocity and err_acc, and neither is changing.)
+        previous, state = state, (process.position, process.velocity, process.output, process.pid.err_acc)
+        if state == previous and process.velocity == 0:
+            for j, time in enumerate(times, start=i + 1):
+                if time > deadline:
+                    return report(time, settled=False, stopped_by='at_rest', steps_saved=j - i)
+                if detector.update(error):
+                    return report(time, settled=True, stopped_by='at_rest', steps_saved=j - i)
+
+        if early is None:
+            continue
+        verdict = early.update(i, error, time)
+        if verdict is not None:
+            return report(time, settled=False, stopped_by=verdict, steps_saved=int((deadline - time) / dt))
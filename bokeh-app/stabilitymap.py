@@ -0,0 +1,172 @@
+import math
+import logging
+import threading
+
+from search import evaluate
+from constants import window
+
+# Where in (p, d) does the arm settle, and how fast?  For one arm and the
+# other gains, e.g.
+#
+#   config = dict(motor="VEX BAG", ratio=150, n_motors=1, mass=5, length=1, cof=0.05, efficiency=0.85,
+#       setpoint=0, f=0.3, i=0.1, izone=20)
+#   for cells in StabilityMap(config).cells():
+#       ...  # draw them
+#
+# The map starts as a coarse grid of cells, each simulated (as Analyze does)
+# at its centre.  Then each cell on the boundary between settling and not, or
+# whose settling time is more than contrast times a neighbour's, is split into
+# four, and so on down to depth, so the boundaries sharpen where they are
+# without simulating the whole fine grid.  Cells come back a batch at a
+# time, coarse first; finer cells overlap the coarse ones they split.  Runs
+# are cut off at deadline, well before simulate()'s own, as those that take
+# that long are as good as unsettled for the map.
+#
+# On the server, SharedMaps makes each map once for every session that wants
+# it, however many are watching the same arm.
+
+log = logging.getLogger(__name__)
+
+
+class StabilityMap:
+    def __init__(self, config, p=(0, 1), d=(0, 1), coarse=8, depth=3, contrast=1.5, initial_position=-math.pi/2,
+            deadline=window * 10, batch_size=32):
+        self.config = { key: value for key, value in config.items() if key not in ['p', 'd'] }
+        self.p = p
+        self.d = d
+        self.coarse = coarse
+        self.depth = depth
+        self.contrast = contrast
+        self.initial_position = initial_position
+        self.deadline = deadline
+        self.batch_size = batch_size
+        self.leaves = {} # (level, column, row): settling time, or inf
+
+    @property
+    def options(self):
+        """Everything but the config that goes into the map, e.g. to cache it by."""
+        return dict(p=list(self.p), d=list(self.d), coarse=self.coarse, depth=self.depth, contrast=self.contrast,
+            deadline=self.deadline)
+
+    def bounds(self, level, column, row):
+        n = self.coarse * 2 ** level
+        (p0, p1), (d0, d1) = self.p, self.d
+        return (p0 + (p1 - p0) * column / n, p0 + (p1 - p0) * (column + 1) / n,
+            d0 + (d1 - d0) * row / n, d0 + (d1 - d0) * (row + 1) / n)
+
+    def leaf(self, level, column, row):
+        """The settling time of the finest cell simulated that contains cell (level, column, row), or None outside."""
+        n = self.coarse * 2 ** level
+        if not (0 <= column < n and 0 <= row < n):
+            return None
+        for up in range(level, -1, -1):
+            cell = (up, column >> (level - up), row >> (level - up))
+            if cell in self.leaves:
+                return self.leaves[cell]
+        return None
+
+    def on_boundary(self, level, column, row):
+        time = self.leaves[(level, column, row)]
+        # Look at the neighbours at the finest level, as they may have been split.
+        scale = 2 ** (self.depth - level)
+        column, row = column * scale, row * scale
+        for k in range(scale):
+            for neighbour in [(column - 1, row + k), (column + scale, row + k), (column + k, row - 1), (column + k, row + scale)]:
+                other = self.leaf(self.depth, *neighbour)
+                if other is not None and max(time, other) > self.contrast * min(time, other):
+                    return True # including settling against not
+        return False
+
+    def simulate(self, cells):
+        """Simulate cells in batches, yielding a list of dicts for each batch."""
+        for k in range(0, len(cells), self.batch_size):
+            batch = cells[k:k + self.batch_size]
+            candidates = []
+            for cell in batch:
+                p0, p1, d0, d1 = self.bounds(*cell)
+                candidates.append(dict(p=(p0 + p1) / 2, d=(d0 + d1) / 2))
+            results = evaluate(self.config, candidates, self.initial_position, self.deadline)
+            rows = []
+            for cell, result in zip(batch, results):
+                self.leaves[cell] = result['settling_time'] if result['settled'] else math.inf
+                p0, p1, d0, d1 = self.bounds(*cell)
+                rows.append(dict(level=cell[0], p0=p0, p1=p1, d0=d0, d1=d1, settled=result['settled'],
+                    settling_time=result['settling_time'] if result['settled'] else None))
+            yield rows
+
+    def cells(self):
+        """Every cell as it's simulated, a batch at a time."""
+        todo = [(0, column, row) for column in range(self.coarse) for row in range(self.coarse)]
+        for level in range(self.depth + 1):
+            yield from self.simulate(todo)
+            if level == self.depth:
+                break
+            split = [cell for cell in todo if self.on_boundary(*cell)]
+            todo = [(level + 1, 2 * column + i, 2 * row + j) for (_, column, row) in split for i in (0, 1) for j in (0, 1)]
+
+
+class SharedMaps:
+    """
+    Maps being made on executor, shared by key (see StabilityMap.options)
+    between everyone who subscribes to the same one, and kept in results (a
+    cache.ResultCache) once done.  A map nobody is subscribed to any more is
+    abandoned after the batch in hand.
+    """
+    def __init__(self, executor, results):
+        self.executor = executor
+        self.results = results
+        self.lock = threading.Lock()
+        self.maps = {} # key: dict(cells, listeners)
+
+    def subscribe(self, key, stability_map, listener):
+        """
+        Call listener(cells, done, error) with the cells so far, then with each
+        batch as it's simulated, then with done, or an error message if the
+        map failed.  It's called from a worker thread, except for the cells
+        so far.  Returns a function that unsubscribes.
+        """
+        cells = []
+        with self.lock:
+            shared = self.maps.get(key)
+            if shared is None:
+                shared = self.maps[key] = dict(cells=[], listeners=[listener])
+                self.executor.submit(self._make, key, stability_map, shared)
+            else:
+                shared['listeners'].append(listener)
+                cells = list(shared['cells'])
+        if cells:
+            listener(cells, False, None)
+
+        def unsubscribe():
+            with self.lock:
+                if listener in shared['listeners']:
+                    shared['listeners'].remove(listener)
+        return unsubscribe
+
+    def _publish(self, key, shared, cells, done=False, error=None):
+        """Tell every listener, returning False if there are none."""
+        with self.lock:
+            shared['cells'].extend(cells)
+            listeners = list(shared['listeners'])
+            if done or not listeners:
+                # From now on, subscribers start afresh, from the cache if done.
+                if self.maps.get(key) is shared:
+                    del self.maps[key]
+        for listener in listeners:
+            listener(cells, done, error)
+        return bool(listeners)
+
+    def _make(self, key, stability_map, shared):
+        try:
+            cached = self.results.get(key)
+            if cached is not None:
+                self._publish(key, shared, cached['cells'], done=True)
+                return
+            for batch in stability_map.cells():
+                if not self._publish(key, shared, batch):
+                    return
+            self.results.put(key, dict(cells=shared['cells']))
+            self._publish(key, shared, [], done=True)
+        except Exception as e:
+            log.exception("Stability map failed")
+            self._publish(key, shared, [], done=True, error=str(e))
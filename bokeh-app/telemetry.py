@@ -0,0 +1,45 @@
+import numpy as np
+
+class TelemetryBuffer:
+    """
+    A fixed-capacity ring buffer of samples, with one numpy array per column.
+
+    Samples are written in place.  Samples not yet read are handed out as
+    views of the arrays, ready for ColumnDataSource.stream, so nothing is
+    allocated per sample.  If more than capacity samples go unread, the
+    oldest are lost.
+    """
+    def __init__(self, columns, capacity):
+        self.columns = list(columns)
+        self.capacity = capacity
+        self.arrays = { column: np.zeros(capacity) for column in self.columns }
+        self.count = 0 # samples ever written
+        self.read = 0 # samples ever read
+
+    def append(self, *rows):
+        """Write one sample, taking its columns from one or more mappings."""
+        index = self.count % self.capacity
+        for row in rows:
+            for key, value in row.items():
+                self.arrays[key][index] = value
+        self.count += 1
+
+    def unread(self):
+        """Views of the samples written since the last call, as a list of (at most two) dicts of arrays."""
+        start = max(self.read, self.count - self.capacity)
+        end = self.count
+        self.read = end
+        segments = []
+        while start < end:
+            first = start % self.capacity
+            last = min(self.capacity, first + end - start)
+            segments.append({ column: array[first:last] for column, array in self.arrays.items() })
+            start += last - first
+        return segments
+
+    def last(self, column):
+        return self.arrays[column][(self.count - 1) % self.capacity]
+
+    def empty(self):
+        """Empty arrays for each column, to start a ColumnDataSource."""
+        return { column: np.zeros(0) for column in self.columns }
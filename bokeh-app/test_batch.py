@@ -0,0 +1,59 @@
+import math
+from functools import partial
+
+import numpy as np
+import pytest
+
+import batch
+from batch import simulate_batch
+from motor import Motor
+from process import configure
+from simulation import simulate
+
+# The README's arm.
+scenario = dict(motor="VEX BAG", ratio=150, n_motors=1, mass=5, length=1, cof=0.05, efficiency=0.85,
+    setpoint=0, f=0.3, p=0.5, i=0.1, d=0.1, izone=20)
+
+configs = [
+    scenario,
+    dict(scenario, p=0.3, i=1, d=0.02),
+    dict(scenario, motor="Vex Falcon 500", ratio=100, mass=1, f=0.12, p=1.8, i=0.28, d=0.05),
+    dict(scenario, motor="Vex Falcon 500", ratio=20, mass=2, f=0.2, p=1.9, i=0.2, d=0.25),
+    dict(scenario, motor="VEX 775 pro", ratio=300, mass=2),
+    dict(scenario, p=5, d=0), # falls away from the setpoint
+]
+initial_positions = [-math.pi / 2, 0.4, -math.pi / 2, 1.0, 1.0, -1.0]
+
+
+def same_as_simulate(configs, initial_positions):
+    inits = [partial(configure, values=values) for values in configs]
+    for init, initial_position, result in zip(inits, initial_positions, simulate_batch(inits, initial_positions)):
+        assert result == simulate(init, initial_position, early_stop=False)
+
+
+# Stepped all together, and then each alone once few are left.
+@pytest.mark.parametrize('alone', [0, batch.alone])
+def test_batch_is_simulate(alone, monkeypatch):
+    monkeypatch.setattr(batch, 'alone', alone)
+    same_as_simulate(configs, initial_positions)
+
+
+def test_batch_is_simulate_to_the_deadline():
+    # Hunts about the setpoint until the deadline, the last of its batch.
+    same_as_simulate([dict(scenario, f=0, p=0.05, i=0.05, d=0, izone=90), scenario], [-math.pi / 2] * 2)
+
+
+@pytest.mark.parametrize('name', list(Motor.motors))
+def test_torque_table_error(name):
+    motor = Motor.motors[name]
+    table = motor.torque_table()
+    outputs, velocities = np.meshgrid(np.linspace(-1, 1, 2001), np.linspace(-1, 1, 401) * motor.free_speed(motor.voltage))
+    error = np.abs(table.lookup_array(velocities, outputs) - motor.torque_array(velocities, outputs))
+    if name != "Vex Falcon 500":
+        # Torque is linear in both output and velocity: the table is exact.
+        assert table.error <= 1e-9 * motor.stall_torque(motor.voltage)
+        assert error.max() <= 1e-9 * motor.stall_torque(motor.voltage)
+    # Up to its free speed at each output, the Falcon 500's table is within 1% of stall torque
+    # (beyond, near its cutoff at about 0.85V, it is not: see TorqueTable).
+    turning = np.abs(velocities) <= motor.free_speed_array(np.abs(outputs) * motor.voltage)
+    assert error[turning].max() <= 0.01 * motor.stall_torque(motor.voltage)
@@ -0,0 +1,30 @@
+import math
+
+import cache
+from cache import ResultCache
+
+# The README's arm.
+scenario = dict(motor="VEX BAG", ratio=150, n_motors=1, mass=5, length=1, cof=0.05, efficiency=0.85,
+    setpoint=0, f=0.3, p=0.5, i=0.1, d=0.1, izone=20)
+
+
+def test_key_compares_numbers_as_floats():
+    as_floats = { k: float(v) if isinstance(v, int) else v for k, v in scenario.items() }
+    assert cache.key(scenario, -math.pi / 2) == cache.key(as_floats, -math.pi / 2)
+    assert cache.key(scenario, 0) == cache.key(scenario, 0.0)
+    assert cache.key(scenario, 0) != cache.key(dict(scenario, ratio=151), 0)
+    assert cache.key(scenario, 0, early_stop=True) != cache.key(scenario, 0, early_stop=1.0)
+
+
+def test_counts(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    results = ResultCache(path=path)
+    assert results.get('a') is None
+    results.put('a', dict(settled=True))
+    assert results.get('a') == dict(settled=True)
+    # Another process's cache finds it on disk.
+    other = ResultCache(path=path)
+    assert other.get('a') == dict(settled=True)
+    assert results.stats == dict(hits=1, disk_hits=0, misses=1, size=1)
+    assert other.stats == dict(hits=1, disk_hits=1, misses=0, size=1)
+    assert other.describe() == "Result cache: 1 hits (1 from disk), 0 misses, 1 in memory"
@@ -0,0 +1,50 @@
+import math
+
+import numpy as np
+import pytest
+
+import linear
+from process import Process, configure
+from constants import update_frequency
+
+# The README's arm.
+scenario = dict(motor="VEX BAG", ratio=150, n_motors=1, mass=5, length=1, cof=0.05, efficiency=0.85,
+    setpoint=0, f=0.3, p=0.5, i=0.1, d=0.1, izone=20)
+
+# Hanging below the axle with no control: as good as undamped.
+hanging = dict(scenario, motor="VEX CIM", ratio=150, mass=1, length=0.1, p=0, i=0, d=0, setpoint=-0.5)
+
+dt = 1.0 / update_frequency
+
+
+def stability(values):
+    process = Process(now=0)
+    configure(process, values)
+    return linear.stability(process)
+
+
+def test_marginal():
+    assert stability(scenario)['stable'] and not stability(scenario)['marginal']
+    result = stability(hanging)
+    assert result['stable'] and result['marginal']
+    assert linear.describe(result).startswith("Linear: marginal")
+
+
+@pytest.mark.parametrize('values', [scenario, hanging, dict(scenario, p=0.3, i=1, d=0.02)])
+def test_step_response_by_blocks(values, monkeypatch):
+    # Stepping a block at a time is stepping one at a time, up to rounding.
+    process = Process(now=0)
+    configure(process, values)
+    A = linear.Linearization(process).matrix()
+    x = np.zeros(len(A))
+    x[0], x[3] = 1, -1
+    positions = []
+    for _ in range(int(60 / dt) + 1):
+        positions.append(x[0])
+        x = A @ x
+    positions = np.array(positions)
+    outside = np.flatnonzero(np.abs(positions) > 0.02)
+    monkeypatch.setattr(np.linalg, 'cond', lambda vectors: math.inf) # as if the poles were repeated
+    result = linear.step_response(A, dt, duration=60)
+    assert result['overshoot'] == pytest.approx(max(0, -positions.min()), rel=1e-9, abs=1e-9)
+    assert result['settling_time'] == pytest.approx((outside[-1] + 1) * dt if len(outside) else 0.0)
@@ -0,0 +1,64 @@
+import math
+
+import pytest
+
+from process import Process, configure
+from constants import update_frequency
+
+# The README's arm.
+scenario = dict(motor="VEX BAG", ratio=150, n_motors=1, mass=5, length=1, cof=0.05, efficiency=0.85,
+    setpoint=0, f=0.3, p=0.5, i=0.1, d=0.1, izone=20)
+
+dt = 1.0 / update_frequency
+
+
+def make_process(physics_frequency=None, position=0.3, values=scenario):
+    process = Process(now=0, physics_frequency=physics_frequency)
+    configure(process, values)
+    process.reset(position, now=0)
+    return process
+
+
+def test_run_at_the_control_rate_is_update():
+    live, analyzed = make_process(physics_frequency=update_frequency), make_process()
+    for k in range(1, 500):
+        result = live.run(now=k * dt)
+        analyzed.update(now=k * dt)
+        assert result['position'] == pytest.approx(analyzed.position, abs=1e-9)
+
+
+@pytest.mark.parametrize('physics_frequency', [update_frequency, 1000])
+def test_run_steps_evenly(physics_frequency):
+    process = make_process(physics_frequency)
+    steps = []
+    for k in range(1, 200):
+        before = process.physics_steps
+        assert process.run(now=k * dt) is not None
+        steps.append(process.physics_steps - before)
+    assert set(steps) == {physics_frequency // update_frequency}
+
+
+def test_run_controls_at_the_control_rate():
+    # Finer physics barely changes the arm, as the PID still runs at update_frequency.
+    live, analyzed = make_process(physics_frequency=1000), make_process()
+    for k in range(1, 50 * update_frequency):
+        live.run(now=k * dt)
+        analyzed.update(now=k * dt)
+    assert live.position == pytest.approx(analyzed.position, abs=0.01)
+    assert live.pid.err_acc == pytest.approx(analyzed.pid.err_acc, abs=0.01)
+
+
+@pytest.mark.parametrize('motor', ["VEX BAG", "Vex Falcon 500"])
+def test_advance_is_update(motor):
+    # The kernel agrees with update() up to rounding, however many steps it's asked for at once.
+    values = dict(scenario, motor=motor)
+    one, many, analyzed = (make_process(values=values) for _ in range(3))
+    for k in range(1, 500):
+        one.advance(dt)
+        analyzed.update(now=k * dt)
+    many.advance(dt, 499)
+    for process in (one, many):
+        assert process.position == pytest.approx(analyzed.position, abs=1e-9)
+        assert process.velocity == pytest.approx(analyzed.velocity, abs=1e-9)
+        assert process.output == pytest.approx(analyzed.output, abs=1e-9)
+        assert process.pid.err_acc == pytest.approx(analyzed.pid.err_acc, abs=1e-9)
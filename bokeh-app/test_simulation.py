@@ -0,0 +1,142 @@
+import math
+import random
+from functools import partial
+from statistics import mean
+
+import pytest
+
+from process import Process, configure
+from simulation import SettlingDetector, is_settled, simulate
+from constants import update_frequency
+
+# SettlingDetector against the O(n²) rescan it replaced: simulate()'s old loop
+# over a list of errors, calling is_settled() each time the scan window was up.
+
+
+def rescan(errors, scan_window):
+    """The old loop: (index settled at, thumb, overshoot, steady state error), or None."""
+    initial_error = errors[0]
+    steady_state_interval = abs(initial_error) * 0.02 * 2
+    overshoot, thumb = 0, 0
+    for i in range(1, len(errors)):
+        error = -errors[i] if initial_error > 0 else errors[i]
+        if error > overshoot:
+            overshoot = error
+            scan_window = max(i, scan_window)
+        if i - thumb > scan_window:
+            (settled, thumb) = is_settled(errors[:i + 1], thumb, steady_state_interval)
+            if settled:
+                return (i, thumb, overshoot, abs(mean(errors[thumb:i]) / initial_error))
+    return None
+
+
+def stream(errors, scan_window):
+    """The same, through SettlingDetector."""
+    detector = SettlingDetector(errors[0], scan_window)
+    for i in range(1, len(errors)):
+        if detector.update(errors[i]):
+            return (i, detector.thumb, detector.overshoot, detector.steady_state_error)
+    return None
+
+
+def decaying(rate, period, n=2000, noise=0.0, seed=0):
+    rng = random.Random(seed)
+    return [math.exp(-k * rate) * math.cos(2 * math.pi * k / period) + rng.gauss(0, noise) for k in range(n)]
+
+
+def edge(width, n=400):
+    """Settles into a band exactly the steady state interval wide: a tie, which counts as settled."""
+    interval = 0.02 * 2
+    return [1.0] + [0.5 - 0.1 * k for k in range(5)] + [(interval / 2 if k % width else -interval / 2) for k in range(n)]
+
+
+def late(scan_window, n=600):
+    """Steady, but for one step out of the interval just as the scan window is up."""
+    errors = [1.0] + [0.0] * n
+    errors[scan_window + 1] = 0.05
+    return errors
+
+
+# The README's arm.
+scenario = dict(motor="VEX BAG", ratio=150, n_motors=1, mass=5, length=1, cof=0.05, efficiency=0.85,
+    setpoint=0, f=0.3, p=0.5, i=0.1, d=0.1, izone=20)
+
+
+def simulated(values, initial_position, seconds=120):
+    process = Process(now=0)
+    configure(process, values)
+    process.reset(initial_position)
+    errors = [process.pid._calculate_difference(process.pid.setpoint - initial_position)]
+    dt = 1.0 / update_frequency
+    for k in range(int(seconds * update_frequency)):
+        process.update(now=(k + 1) * dt)
+        errors.append(process.pid._calculate_difference(process.pid.setpoint - process.position))
+    return errors
+
+
+cases = dict(
+    fast=decaying(0.05, 20),
+    slow=decaying(0.005, 50),
+    noisy=decaying(0.02, 30, noise=1e-3),
+    negative=[-x for x in decaying(0.02, 30)],
+    constant=[1.0] * 500,
+    at_rest=[1.0] + [0.0] * 500,
+    edge=edge(1),
+    edge_alternating=edge(2),
+    edge_late=late(50),
+    edge_after=late(51),
+    never=[math.cos(2 * math.pi * k / 40) for k in range(2000)], # never settles
+    growing=[math.exp(k * 0.001) * math.cos(k / 7) * 0.5 for k in range(2000)], # nor this
+    arm=simulated(scenario, -math.pi / 2),
+    arm_overshooting=simulated(dict(scenario, p=0.3, i=1, d=0.02), -math.pi / 2),
+    arm_oscillating=simulated(dict(scenario, f=0, p=0.05, i=0.05, d=0, izone=90), -math.pi / 2), # never settles
+)
+
+
+# simulate() uses window * update_frequency * 2, the last.
+@pytest.mark.parametrize('scan_window', [50, 200, 3000])
+@pytest.mark.parametrize('name', list(cases))
+def test_matches_rescan(name, scan_window):
+    assert stream(cases[name], scan_window) == rescan(cases[name], scan_window)
+
+
+# The early stop on by default is sound: the same verdict as running to the end.
+
+@pytest.mark.parametrize('scan_window', [50, 200, 3000])
+@pytest.mark.parametrize('name', list(cases))
+def test_out_of_time_is_sound(name, scan_window):
+    # Whenever simulate() would stop, taking the end of the errors as the deadline, they don't settle.
+    errors = cases[name]
+    deadline = len(errors) - 1
+    settles = stream(errors, scan_window) is not None
+    detector = SettlingDetector(errors[0], scan_window)
+    for i in range(1, len(errors)):
+        if detector.update(errors[i]):
+            break
+        if detector.start + detector.scan_window + 1 > deadline:
+            assert not settles
+            break
+
+
+@pytest.mark.parametrize('values', [
+    scenario,
+    dict(scenario, p=0.3, i=1, d=0.02),
+    dict(scenario, f=0, p=0.05, i=0.05, d=0, izone=90), # hunts until the deadline
+    dict(scenario, p=5, d=0), # falls away from the setpoint
+], ids=['settles', 'overshoots', 'hunts', 'fails'])
+def test_early_stop_verdict(values):
+    init = partial(configure, values=values)
+    early, full = simulate(init, -math.pi / 2), simulate(init, -math.pi / 2, early_stop=False)
+    if early['detector'] is None:
+        assert early == full
+    else:
+        for key in ['final_time', 'detector', 'steps_saved']:
+            del early[key], full[key]
+        assert early == full
+
+
+def test_memory_doesnt_grow():
+    # Nothing is kept per step: that would be about 100 kB a minute.
+    import benchmark
+    (growth, peak) = benchmark.bench_memory()
+    assert growth < 10_000
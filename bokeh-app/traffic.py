@@ -0,0 +1,38 @@
+import json
+from time import time
+
+from bokeh.protocol import Protocol
+
+# How much a session sends to its browser.  The server encodes each change to
+# the document as a PATCH-DOC message, a few JSON parts plus binary buffers
+# for numpy arrays; the meter encodes each change the same way to count it.
+# That doubles the encoding work, so it's only for measuring.
+
+
+class TrafficMeter:
+    def __init__(self, doc):
+        self.protocol = Protocol()
+        self.start = time()
+        self.bytes = 0
+        self.buffer_bytes = 0 # of bytes, those sent as binary buffers
+        self.messages = 0
+        doc.on_change(self.changed)
+
+    def changed(self, event):
+        if not hasattr(event, 'to_serializable'):
+            return # not sent to the browser
+        message = self.protocol.create("PATCH-DOC", [event])
+        # Each buffer goes as a small JSON header, then the bytes.
+        buffer_bytes = sum(len(json.dumps(buffer.ref)) + len(buffer.to_bytes()) for buffer in message.buffers)
+        self.bytes += len(message.header_json) + len(message.metadata_json) + len(message.content_json) + buffer_bytes
+        self.buffer_bytes += buffer_bytes
+        self.messages += 1
+
+    def rate(self):
+        """Bytes per second since the last call, and the fraction of them in binary buffers."""
+        now = time()
+        rate = self.bytes / max(now - self.start, 1e-9)
+        binary = self.buffer_bytes / self.bytes if self.bytes else 0
+        self.start = now
+        self.bytes = self.buffer_bytes = self.messages = 0
+        return rate, binary